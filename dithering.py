@@ -0,0 +1,128 @@
+"""
+Алгоритмы перевода изображения в оттенках серого ("L") в 1-битное ("1").
+
+Пороговый и упорядоченный (Байер) режимы выполняются целиком операциями
+Pillow над всем изображением сразу и почти не нагружают процессор.
+Флойд–Стейнберг использует встроенную реализацию Pillow, Аткинсон — построчный
+проход с распространением ошибки.
+
+Pillow импортируется внутри функций: модуль подключается при старте сервера
+ради списка DITHER_MODES.
+"""
+
+DITHER_MODES = ("auto", "threshold", "bayer", "floyd-steinberg", "atkinson")
+
+# Матрица Байера 8x8 (значения 0..63)
+BAYER_8X8 = [
+    [0, 32, 8, 40, 2, 34, 10, 42],
+    [48, 16, 56, 24, 50, 18, 58, 26],
+    [12, 44, 4, 36, 14, 46, 6, 38],
+    [60, 28, 52, 20, 62, 30, 54, 22],
+    [3, 35, 11, 43, 1, 33, 9, 41],
+    [51, 19, 59, 27, 49, 17, 57, 25],
+    [15, 47, 7, 39, 13, 45, 5, 37],
+    [63, 31, 55, 23, 61, 29, 53, 21],
+]
+
+_bayer_tiles = {}
+
+
+def threshold(img, level=128, top=0):
+    """Точка чёрная, если яркость ниже level."""
+    return img.point([0 if v < level else 255 for v in range(256)], "1")
+
+
+def _bayer_map(width, height, top):
+    """Карта порогов Байера нужного размера, начиная со строки top (для полос)."""
+    key = (width, height, top % 8)
+    tile = _bayer_tiles.get(key)
+    if tile is None:
+        from PIL import Image
+
+        cell = Image.new("L", (8, 8))
+        cell.putdata(
+            [(BAYER_8X8[(y + top) % 8][x] * 4) + 2 for y in range(8) for x in range(8)]
+        )
+        tile = Image.new("L", (width, height))
+        for y in range(0, height, 8):
+            for x in range(0, width, 8):
+                tile.paste(cell, (x, y))
+        _bayer_tiles.clear()  # Храним только карту последнего размера полосы
+        _bayer_tiles[key] = tile
+    return tile
+
+
+def bayer(img, top=0):
+    """Упорядоченный дизеринг: сравнение с повторяющейся картой порогов."""
+    from PIL import ImageChops
+
+    thresholds = _bayer_map(img.width, img.height, top)
+    # Ненулевая разность — яркость пикселя ниже порога, то есть чёрная точка
+    darker = ImageChops.subtract(thresholds, img)
+    return darker.point([255 if v == 0 else 0 for v in range(256)], "1")
+
+
+def floyd_steinberg(img, top=0):
+    from PIL import Image
+
+    return img.convert("1", dither=Image.FLOYDSTEINBERG)
+
+
+def atkinson(img, top=0):
+    """
+    Дизеринг Аткинсона: распространяет 3/4 ошибки на шесть соседей,
+    даёт более контрастный результат, чем Флойд–Стейнберг.
+    """
+    from PIL import Image
+
+    width, height = img.size
+    pixels = list(img.getdata())
+    out = bytearray(width * height)
+    # Накопленная ошибка для текущей и двух следующих строк
+    rows = [[0] * (width + 2) for _ in range(3)]
+    for y in range(height):
+        current, below, below2 = rows
+        offset = y * width
+        for x in range(width):
+            value = pixels[offset + x] + current[x]
+            if value < 128:
+                error = value
+            else:
+                out[offset + x] = 255
+                error = value - 255
+            error >>= 3
+            if error:
+                current[x + 1] += error
+                current[x + 2] += error
+                below[x - 1] += error
+                below[x] += error
+                below[x + 1] += error
+                below2[x] += error
+        rows = [below, below2, [0] * (width + 2)]
+    return Image.frombytes("L", (width, height), bytes(out)).convert("1")
+
+
+DITHERERS = {
+    "threshold": threshold,
+    "bayer": bayer,
+    "floyd-steinberg": floyd_steinberg,
+    "atkinson": atkinson,
+}
+
+
+def dither(img, mode="auto", document=False, top=0):
+    """
+    Переводит изображение "L" в "1" выбранным алгоритмом.
+
+    :param mode: Один из DITHER_MODES. auto — порог для документов
+                 и Флойд–Стейнберг для фотографий.
+    :param document: Результат классификации документ/фото (для auto).
+    :param top: Номер первой строки изображения в общей картинке (для полос).
+    """
+    if mode == "auto":
+        mode = "threshold" if document else "floyd-steinberg"
+    try:
+        ditherer = DITHERERS[mode]
+    except KeyError:
+        raise ValueError(f"Неизвестный режим дизеринга: {mode}")
+    return ditherer(img, top=top)
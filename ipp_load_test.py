@@ -0,0 +1,346 @@
+"""
+Нагрузочный тест IPP-сервера.
+
+Запускает IPPServer в этом же процессе с пулом принтеров-заглушек (без Bluetooth)
+и имитирует одновременных клиентов: каждый в цикле опрашивает принтер
+Get-Printer-Attributes и время от времени отправляет Print-Job с документом
+text/plain (рендер без Ghostscript). В конце выводит перцентили задержки по
+операциям, долю ошибок, пиковое число потоков и память процесса.
+
+Пример:
+    python ipp_load_test.py --clients 20 --duration 30 --print-ratio 0.1
+
+С --url нагружается уже запущенный сервер (принтеры и память тогда его).
+"""
+
+import io
+import os
+import sys
+import time
+import random
+import logging
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+import http.client
+from contextlib import redirect_stdout
+from urllib.parse import urlsplit
+
+import ipp_server
+from ipp_server import (
+    IppRequest,
+    IPPRequestHandler,
+    IPPServer,
+    OperationEnum,
+    PostscriptHandler,
+    SectionEnum,
+    StatusCodeEnum,
+    TagEnum,
+)
+from main import BLEPrinter, PrinterPool
+
+
+class StubBLEPrinter(BLEPrinter):
+    """BLEPrinter без радио: «печатает» пакеты, выдерживая паузу на пакет."""
+
+    def __init__(self, target_name="stub", packet_delay=0.0):
+        super().__init__(target_name=target_name)
+        self.packet_delay = packet_delay
+
+    @property
+    def is_connected(self):
+        return True
+
+    async def ble_print_packets(self, packets, connection_manager=None, total=None):
+        for _packet in packets:
+            if self.packet_delay:
+                await asyncio.sleep(self.packet_delay)
+
+
+class StubPrinterPool(PrinterPool):
+    """Пул из принтеров-заглушек: без поиска устройств и менеджеров соединений."""
+
+    def __init__(self, count=1, packet_delay=0.0):
+        super().__init__(specs=())
+        self.printers = [
+            StubBLEPrinter(f"stub-{index}", packet_delay)
+            for index in range(1, count + 1)
+        ]
+        self.managers = {printer: None for printer in self.printers}
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+def ipp_message(operation, request_id, printer_uri, attributes=None):
+    """Кодирует запрос IPP с обязательными атрибутами операции."""
+    attrs = {
+        (SectionEnum.operation, b"attributes-charset", TagEnum.charset): [b"utf-8"],
+        (
+            SectionEnum.operation,
+            b"attributes-natural-language",
+            TagEnum.natural_language,
+        ): [b"en"],
+        (SectionEnum.operation, b"printer-uri", TagEnum.uri): [printer_uri],
+    }
+    attrs.update(attributes or {})
+    return IppRequest((1, 1), operation, request_id, attrs).to_string()
+
+
+def sample_document(lines):
+    return "".join(
+        f"Заказ {index:05d}  ячейка A-{index % 40:02d}  x{index % 7 + 1}\n"
+        for index in range(lines)
+    ).encode("utf-8")
+
+
+class LoadStats:
+    """Задержки и результаты запросов по операциям (потокобезопасно)."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.results = {}
+        self._lock = threading.Lock()
+
+    def add(self, operation, latency, result):
+        with self._lock:
+            self.latencies.setdefault(operation, []).append(latency)
+            counts = self.results.setdefault(operation, {})
+            counts[result] = counts.get(result, 0) + 1
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+class ResourceSampler(threading.Thread):
+    """Периодически замеряет число потоков и резидентную память процесса."""
+
+    def __init__(self, interval=0.2):
+        super().__init__(name="ResourceSampler", daemon=True)
+        self.interval = interval
+        self.max_threads = 0
+        self.max_rss = 0
+        self.stopped = threading.Event()
+
+    @staticmethod
+    def rss():
+        """Резидентная память процесса в байтах (0, если /proc недоступен)."""
+        try:
+            with open("/proc/self/statm", "r") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            return 0
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.max_threads = max(self.max_threads, threading.active_count())
+            self.max_rss = max(self.max_rss, self.rss())
+
+
+def run_client(host, port, path, printer_uri, document, args, stats, deadline):
+    """Один клиент: запросы подряд до истечения deadline."""
+    rng = random.Random()
+    request_id = 0
+    while time.monotonic() < deadline:
+        request_id += 1
+        if rng.random() < args.print_ratio:
+            operation = "Print-Job"
+            body = (
+                ipp_message(
+                    OperationEnum.print_job,
+                    request_id,
+                    printer_uri,
+                    {
+                        (
+                            SectionEnum.operation,
+                            b"document-format",
+                            TagEnum.mime_media_type,
+                        ): [b"text/plain"],
+                    },
+                )
+                + document
+            )
+        else:
+            operation = "Get-Printer-Attributes"
+            body = ipp_message(
+                OperationEnum.get_printer_attributes, request_id, printer_uri
+            )
+
+        started = time.monotonic()
+        try:
+            connection = http.client.HTTPConnection(host, port, timeout=args.timeout)
+            # Тело передаётся частями, как это делает CUPS
+            connection.request(
+                "POST",
+                path,
+                body=iter([body]),
+                headers={"Content-Type": "application/ipp"},
+                encode_chunked=True,
+            )
+            response = connection.getresponse()
+            payload = response.read()
+            connection.close()
+            if response.status != 200:
+                result = f"HTTP {response.status}"
+            else:
+                status = IppRequest.from_string(payload).opid_or_status
+                try:
+                    result = StatusCodeEnum(status).name
+                except ValueError:
+                    result = f"0x{status:04x}"
+        except Exception as e:
+            result = type(e).__name__
+        stats.add(operation, time.monotonic() - started, result)
+
+
+def start_local_server(args, spool_dir):
+    """Запускает IPPServer с принтерами-заглушками на свободном порту."""
+    threading.Thread(
+        target=ipp_server.start_ble_loop, name="BLELoopThread", daemon=True
+    ).start()
+    server = IPPServer(("127.0.0.1", 0), IPPRequestHandler, None)
+    handler = PostscriptHandler(
+        ("127.0.0.1", server.server_address[1]),
+        printers=("stub",) * args.printers,
+        render_workers=1,
+        max_jobs=args.max_jobs,
+        hold_timeout=args.hold_timeout,
+        spool_dir=spool_dir,
+    )
+    handler.printer_pool = StubPrinterPool(args.printers, args.packet_delay)
+    server.postscript = handler
+    threading.Thread(target=server.serve_forever, name="IPPServer", daemon=True).start()
+    return server
+
+
+def report(stats, sampler, elapsed, local):
+    print(f"Длительность: {elapsed:.1f} с")
+    for operation in sorted(stats.latencies):
+        latencies = sorted(stats.latencies[operation])
+        results = stats.results[operation]
+        errors = sum(count for result, count in results.items() if result != "ok")
+        print(
+            f"{operation}: {len(latencies)} запросов, "
+            f"{len(latencies) / elapsed:.1f}/с, ошибок {errors} "
+            f"({errors / len(latencies):.1%})"
+        )
+        print(
+            "  задержка, мс: "
+            f"p50={percentile(latencies, 0.5) * 1000:.1f} "
+            f"p90={percentile(latencies, 0.9) * 1000:.1f} "
+            f"p99={percentile(latencies, 0.99) * 1000:.1f} "
+            f"max={latencies[-1] * 1000:.1f}"
+        )
+        for result, count in sorted(results.items()):
+            if result != "ok":
+                print(f"  {result}: {count}")
+    print(f"Потоков (пик): {sampler.max_threads}")
+    if sampler.max_rss:
+        scope = "клиенты и сервер" if local else "только клиенты"
+        print(f"Резидентная память (пик, {scope}): {sampler.max_rss / 2**20:.1f} МБ")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест IPP-сервера")
+    parser.add_argument(
+        "--url",
+        type=str,
+        default=None,
+        help="URI принтера уже запущенного сервера (по умолчанию — свой сервер с заглушками)",
+    )
+    parser.add_argument(
+        "--clients", type=int, default=10, help="Число одновременных клиентов"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=10, help="Длительность теста в секундах"
+    )
+    parser.add_argument(
+        "--print-ratio",
+        type=float,
+        default=0.2,
+        help="Доля запросов Print-Job среди запросов клиента",
+    )
+    parser.add_argument(
+        "--lines", type=int, default=20, help="Число строк в документе text/plain"
+    )
+    parser.add_argument(
+        "--printers", type=int, default=1, help="Число принтеров-заглушек в пуле"
+    )
+    parser.add_argument(
+        "--packet-delay",
+        type=float,
+        default=0.0,
+        help="Имитация передачи: пауза принтера-заглушки на пакет, с",
+    )
+    parser.add_argument("--max-jobs", type=int, default=4)
+    parser.add_argument("--hold-timeout", type=float, default=0)
+    parser.add_argument(
+        "--timeout", type=float, default=60, help="Таймаут запроса клиента, с"
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Не скрывать вывод сервера"
+    )
+    args = parser.parse_args()
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+    else:
+        # Отказы server-error-busy под нагрузкой ожидаемы, они видны в отчёте
+        logging.disable(logging.WARNING)
+
+    spool_dir = None
+    server = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port, path = url.hostname, url.port or 631, url.path or "/"
+        printer_uri = args.url.encode("ascii")
+    else:
+        spool_dir = tempfile.mkdtemp(prefix="ipp-load-spool-")
+        server = start_local_server(args, spool_dir)
+        host, port = server.server_address
+        path = "/ipp/print"
+        printer_uri = f"ipp://{host}:{port}{path}".encode("ascii")
+
+    document = sample_document(args.lines)
+    stats = LoadStats()
+    sampler = ResourceSampler()
+    sampler.start()
+    print(f"Нагрузка на {host}:{port}: {args.clients} клиентов, {args.duration:g} с...")
+    output = sys.stdout if args.verbose else io.StringIO()
+    started = time.monotonic()
+    deadline = started + args.duration
+    with redirect_stdout(output):
+        clients = [
+            threading.Thread(
+                target=run_client,
+                args=(host, port, path, printer_uri, document, args, stats, deadline),
+                name=f"Client-{index}",
+            )
+            for index in range(args.clients)
+        ]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+    elapsed = time.monotonic() - started
+    sampler.stopped.set()
+
+    report(stats, sampler, elapsed, server is not None)
+
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+        server.postscript.render_executor.shutdown()
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import io
+import os
 import time
 import struct
 import logging
@@ -6,15 +7,55 @@ import socketserver
 import itertools
 import operator
 import random
+import re
 import asyncio
+import argparse
 import threading
+import zlib
+import collections
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from http.server import BaseHTTPRequestHandler
 from io import BytesIO
 
-from wand.image import Image
-from wand.color import Color
-
-from main import BLEPrinter
+# Wand (ImageMagick), Pillow и рендеры импортируются при первом использовании:
+# сокет сервера открывается, не дожидаясь загрузки тяжёлых библиотек
+from main import (
+    BLEPrinter,
+    PrinterPool,
+    CLASSIFY_PIXELS,
+    BLE_WRITE_MODES,
+    DEFAULT_JOB_PRIORITY,
+    ORIENTATION_MODES,
+)
+from dithering import DITHER_MODES
+from job_spool import JobSpool, write_page_packets, page_file_name
+from job_profiler import JobProfiler, run_profiled
+
+# Момент запуска процесса, от которого считается время готовности сервера
+START_TIME = time.monotonic()
+
+# Формат документа с этикетками «тип:данные» по одной на строку
+LABEL_DOCUMENT_FORMAT = b"application/vnd.catcombo-label"
+
+# Сжатие документов, которое сервер распаковывает при приёме (атрибут compression)
+COMPRESSION_SUPPORTED = (b"none", b"gzip", b"deflate")
+
+# Форматы документов; application/octet-stream определяется по первым байтам
+DOCUMENT_FORMAT_SUPPORTED = (
+    b"application/pdf",
+    b"application/postscript",
+    b"application/octet-stream",
+    b"text/plain",
+    LABEL_DOCUMENT_FORMAT,
+)
+
+# Сколько страниц одного документа растеризуется в пуле одновременно
+PAGES_IN_FLIGHT = 4
+
+# Пауза перед повторной попыткой допечатать задание из очереди, в секундах
+RECOVERY_RETRY_INTERVAL = 30
 
 # Создаем глобальный event loop для BLE операций
 ble_loop = asyncio.new_event_loop()
@@ -25,15 +66,32 @@ def start_ble_loop():
     ble_loop.run_forever()
 
 
-def schedule_ble_print_job(ble_printer, image_bytes):
-    # Планируем выполнение ble_print_job в нашем ble_loop
+def schedule_ble_print_job(ble_printer, packets, connection_manager=None, total=None):
+    # Планируем печать готовых пакетов в нашем ble_loop
     future = asyncio.run_coroutine_threadsafe(
-        ble_printer.ble_print_job(image_bytes), ble_loop
+        ble_printer.ble_print_packets(packets, connection_manager, total), ble_loop
     )
     # Ожидаем завершения задачи и возвращаем результат (если необходимо)
     return future.result()
 
 
+def acquire_ble_printer(
+    printer_pool, target=None, priority=DEFAULT_JOB_PRIORITY, packets=None
+):
+    # Ждём свободный принтер пула в нашем ble_loop
+    future = asyncio.run_coroutine_threadsafe(
+        printer_pool.acquire(target, priority, packets), ble_loop
+    )
+    return future.result()
+
+
+def release_ble_printer(printer_pool, ble_printer):
+    future = asyncio.run_coroutine_threadsafe(
+        printer_pool.release(ble_printer), ble_loop
+    )
+    return future.result()
+
+
 # =====================
 # Вспомогательные функции
 # =====================
@@ -67,6 +125,17 @@ class BasicPostscriptPPD:
         with open(self.filename, "r", encoding="utf-8", errors="ignore") as f:
             return f.read()
 
+    def media_sizes(self):
+        """Размеры носителей из *PaperDimension: {имя: (ширина, высота)} в пунктах."""
+        return {
+            name: (float(width), float(height))
+            for name, width, height in re.findall(
+                r'^\*PaperDimension\s+([^/:\s]+)[^:]*:\s*"([\d.]+)\s+([\d.]+)"',
+                self.text(),
+                re.MULTILINE,
+            )
+        }
+
 
 # =====================
 # Стандартные enum-коды для IPP
@@ -121,8 +190,17 @@ class TagEnum(IntEnum):
 class StatusCodeEnum(IntEnum):
     # https://tools.ietf.org/html/rfc2911#section-13.1
     ok = 0x0000
+    successful_ok_ignored_or_substituted_attributes = 0x0001
+    client_error_bad_request = 0x0400
+    client_error_not_found = 0x0406
+    client_error_document_format_not_supported = 0x040A
+    client_error_compression_not_supported = 0x040F
+    client_error_compression_error = 0x0410
+    client_error_document_format_error = 0x0411
     server_error_internal_error = 0x0500
     server_error_operation_not_supported = 0x0501
+    server_error_not_accepting_jobs = 0x0506
+    server_error_busy = 0x0507
     server_error_job_canceled = 0x508
 
 
@@ -130,6 +208,8 @@ class OperationEnum(IntEnum):
     # https://tools.ietf.org/html/rfc2911#section-4.4.15
     print_job = 0x0002
     validate_job = 0x0004
+    create_job = 0x0005
+    send_document = 0x0006
     cancel_job = 0x0008
     get_job_attributes = 0x0009
     get_jobs = 0x000A
@@ -171,6 +251,13 @@ class IppRequest(object):
             self._attributes,
         )
 
+    def get_attribute(self, name, section=SectionEnum.operation):
+        """Возвращает первое значение атрибута (bytes) или None, если его нет."""
+        for (attr_section, attr_name, _tag), values in self._attributes.items():
+            if attr_section == section and attr_name == name and values:
+                return values[0]
+        return None
+
     @classmethod
     def from_string(cls, string):
         return cls.from_file(BytesIO(string))
@@ -259,10 +346,28 @@ class IppRequest(object):
 # =====================
 
 
+def status_message_attribute(message):
+    """Атрибут status-message ответа; пустой словарь, если сообщения нет."""
+    if not message:
+        return {}
+    return {
+        (SectionEnum.operation, b"status-message", TagEnum.text_without_language): [
+            message.encode("utf-8")
+        ]
+    }
+
+
 def get_job_id(req):
-    """Пример функции, чтобы достать job-id из атрибутов запроса (необязательно)."""
-    # Здесь можно пропарсить req._attributes
-    return 1
+    """Достаёт номер задания из атрибута job-id или job-uri запроса."""
+    job_id = req.get_attribute(b"job-id")
+    if job_id is not None:
+        return struct.unpack(">i", job_id)[0]
+    job_uri = req.get_attribute(b"job-uri")
+    if job_uri is not None:
+        tail = job_uri.rstrip(b"/").rsplit(b"/", 1)[-1]
+        if tail.isdigit():
+            return int(tail)
+    return None
 
 
 class IPPPrinterMethod:
@@ -280,6 +385,8 @@ class IPPPrinterMethod:
             OperationEnum.get_jobs: self.operation_get_jobs_response,
             OperationEnum.get_job_attributes: self.operation_get_job_attributes_response,
             OperationEnum.print_job: self.operation_print_job_response,
+            OperationEnum.create_job: self.operation_create_job_response,
+            OperationEnum.send_document: self.operation_send_document_response,
             0x0D0A: self.operation_misidentified_as_http,
         }
 
@@ -303,26 +410,177 @@ class IPPPrinterMethod:
         attributes = self.printer_list_attributes()
         return IppRequest(self.version, StatusCodeEnum.ok, req.request_id, attributes)
 
-    def operation_validate_job_response(self, req, _psfile):
-        # TODO: здесь просто возвращается ОК
-        attributes = self.minimal_attributes()
-        return IppRequest(self.version, StatusCodeEnum.ok, req.request_id, attributes)
+    def operation_validate_job_response(self, req, psfile):
+        if not self.accepting_jobs(req):
+            return self.operation_not_accepting_response(req)
+        problem = self.preflight_job(req)
+        if problem is None and psfile is not None:
+            # Документа в Validate-Job обычно нет; если клиент его приложил,
+            # смотрим только на начало
+            try:
+                head = self.document_stream(req, psfile).read(PREFLIGHT_HEAD_SIZE)
+            except zlib.error as e:
+                problem = StatusCodeEnum.client_error_compression_error, str(e)
+            else:
+                if head:
+                    problem = self.preflight_job(req, head, complete=False)
+        return self.operation_status_response(req, *(problem or (StatusCodeEnum.ok,)))
 
     def operation_get_jobs_response(self, req, _psfile):
         # Пустой список заданий
         attributes = self.minimal_attributes()
         return IppRequest(self.version, StatusCodeEnum.ok, req.request_id, attributes)
 
+    def operation_not_accepting_response(self, req):
+        # Отказываем сразу, не тратя время на растеризацию
+        logging.warning("Задание отклонено: принтер не может печатать")
+        attributes = self.minimal_attributes()
+        attributes.update(self.printer_state_attributes())
+        return IppRequest(
+            self.version,
+            StatusCodeEnum.server_error_not_accepting_jobs,
+            req.request_id,
+            attributes,
+        )
+
+    def operation_busy_response(self, req):
+        logging.warning("Задание отклонено: сервер перегружен")
+        return IppRequest(
+            self.version,
+            StatusCodeEnum.server_error_busy,
+            req.request_id,
+            self.minimal_attributes(),
+        )
+
+    def operation_job_failed_response(self, req, job, error):
+        """
+        Ответ на задание, которое не удалось растеризовать или напечатать:
+        клиент получает статус IPP вместо оборванного соединения.
+        """
+        logging.exception("Задание %s не напечатано", job.job_id)
+        if isinstance(error, ValueError):
+            # Данные документа, которые не удалось разобрать
+            status = StatusCodeEnum.client_error_document_format_error
+        else:
+            status = StatusCodeEnum.server_error_internal_error
+        return self.operation_status_response(req, status, str(error))
+
+    def operation_status_response(self, req, status, message=None):
+        if status >= StatusCodeEnum.client_error_bad_request:
+            logging.warning("Задание отклонено: %s", message or status.name)
+        attributes = self.minimal_attributes()
+        attributes.update(status_message_attribute(message))
+        return IppRequest(self.version, status, req.request_id, attributes)
+
     def operation_print_job_response(self, req, psfile):
-        job_id = self.create_job(req)
+        if not self.accepting_jobs(req):
+            return self.operation_not_accepting_response(req)
+        problem = self.preflight_job(req)
+        if problem is not None:
+            return self.operation_status_response(req, *problem)
+        # Документ сразу пишется в очередь на диске и дальше читается через mmap
+        try:
+            job = self.spool_job(req, psfile)
+        except zlib.error as e:
+            logging.warning("Не удалось распаковать документ: %s", e)
+            return self.operation_status_response(
+                req, StatusCodeEnum.client_error_compression_error
+            )
+        # Испорченный документ отклоняется до допуска и растеризации
+        if job.documents:
+            status, message = self.preflight_spooled_document(req, job)
+        else:
+            status, message = StatusCodeEnum.client_error_bad_request, "Пустой документ"
+        if status >= StatusCodeEnum.client_error_bad_request:
+            job.remove()
+            return self.operation_status_response(req, status, message)
+        if not self.admit_job(req, job):
+            job.remove()
+            return self.operation_busy_response(req)
+        try:
+            attributes = self.print_job_attributes(
+                job.job_id,
+                JobStateEnum.pending,
+                [b"job-incoming", b"job-data-insufficient"],
+            )
+            self.handle_postscript(job)
+        except Exception as e:
+            return self.operation_job_failed_response(req, job, e)
+        finally:
+            # Задание удаляется из очереди и при ошибке; на диске остаются
+            # только задания, прерванные остановкой сервера
+            self.close_job(job)
+        attributes.update(status_message_attribute(message))
+        return IppRequest(self.version, status, req.request_id, attributes)
+
+    def operation_create_job_response(self, req, _psfile):
+        if not self.accepting_jobs(req):
+            return self.operation_not_accepting_response(req)
+        job = self.spool.create_job(self.create_job(req), self.job_options(req))
+        self.open_job(job)
         attributes = self.print_job_attributes(
-            job_id, JobStateEnum.pending, [b"job-incoming", b"job-data-insufficient"]
+            job.job_id, JobStateEnum.pending, [b"job-incoming"]
         )
-        self.handle_postscript(req, psfile)
         return IppRequest(self.version, StatusCodeEnum.ok, req.request_id, attributes)
 
+    def operation_send_document_response(self, req, psfile):
+        problem = self.preflight_job(req)
+        if problem is not None:
+            return self.operation_status_response(req, *problem)
+        job = self.take_open_job(get_job_id(req))
+        if job is None:
+            return self.operation_status_response(
+                req, StatusCodeEnum.client_error_not_found
+            )
+        last = req.get_attribute(b"last-document") == pack_bool(True)
+        try:
+            added = job.write_document(
+                self.document_stream(req, psfile), self.document_options(req), last
+            )
+        except zlib.error as e:
+            logging.warning("Не удалось распаковать документ: %s", e)
+            self.close_job(job)
+            return self.operation_status_response(
+                req, StatusCodeEnum.client_error_compression_error
+            )
+        except Exception:
+            # Обрыв соединения, ошибка очереди или тела запроса: задание
+            # не остаётся открытым и не держит принтер
+            self.close_job(job)
+            raise
+        # Каждый документ печатается сразу по приходу, принтер задание держит
+        # за собой до последнего документа
+        status, message = StatusCodeEnum.ok, None
+        if added:
+            status, message = self.preflight_spooled_document(req, job)
+            if status >= StatusCodeEnum.client_error_bad_request:
+                self.close_job(job)
+                return self.operation_status_response(req, status, message)
+            # Задание допускается один раз, при первом документе: резерв
+            # держится за ним до закрытия, и следующие документы не ждут
+            # за заданиями, которые стоят в очереди к его же принтеру
+            if not self.admit_job(req, job):
+                # Задание остаётся открытым, документ можно отправить повторно
+                job.discard_last_document()
+                self.open_job(job)
+                return self.operation_busy_response(req)
+            try:
+                self.handle_postscript(job)
+            except Exception as e:
+                self.close_job(job)
+                return self.operation_job_failed_response(req, job, e)
+        if job.last_document:
+            self.close_job(job)
+            state, reasons = JobStateEnum.completed, [b"none"]
+        else:
+            self.open_job(job)
+            state, reasons = JobStateEnum.processing, [b"job-incoming"]
+        attributes = self.print_job_attributes(job.job_id, state, reasons)
+        attributes.update(status_message_attribute(message))
+        return IppRequest(self.version, status, req.request_id, attributes)
+
     def operation_get_job_attributes_response(self, req, _psfile):
-        job_id = get_job_id(req)
+        job_id = get_job_id(req) or 1
         attributes = self.print_job_attributes(
             job_id, JobStateEnum.completed, [b"none"]
         )
@@ -348,7 +606,8 @@ class IPPPrinterMethod:
         attr = {
             (SectionEnum.printer, b"printer-uri-supported", TagEnum.uri): [
                 self.printer_uri
-            ],
+            ]
+            + self.printer_uris,
             (SectionEnum.printer, b"uri-authentication-supported", TagEnum.keyword): [
                 b"none"
             ],
@@ -366,16 +625,14 @@ class IPPPrinterMethod:
                 b"printer-make-and-model",
                 TagEnum.text_without_language,
             ): [self.printer_name],
-            (SectionEnum.printer, b"printer-state", TagEnum.enum): [
-                pack_enum(3)
-            ],  # 3 = idle
-            (SectionEnum.printer, b"printer-state-reasons", TagEnum.keyword): [b"none"],
             (SectionEnum.printer, b"ipp-versions-supported", TagEnum.keyword): [b"1.1"],
             (SectionEnum.printer, b"operations-supported", TagEnum.enum): [
                 pack_enum(x)
                 for x in (
                     OperationEnum.print_job,
                     OperationEnum.validate_job,
+                    OperationEnum.create_job,
+                    OperationEnum.send_document,
                     OperationEnum.cancel_job,
                     OperationEnum.get_job_attributes,
                     OperationEnum.get_printer_attributes,
@@ -385,7 +642,10 @@ class IPPPrinterMethod:
                 SectionEnum.printer,
                 b"multiple-document-jobs-supported",
                 TagEnum.boolean,
-            ): [pack_bool(False)],
+            ): [pack_bool(True)],
+            (SectionEnum.printer, b"multiple-operation-time-out", TagEnum.integer): [
+                pack_int(self.multiple_operation_timeout)
+            ],
             (SectionEnum.printer, b"charset-configured", TagEnum.charset): [b"utf-8"],
             (SectionEnum.printer, b"charset-supported", TagEnum.charset): [b"utf-8"],
             (
@@ -407,25 +667,145 @@ class IPPPrinterMethod:
                 SectionEnum.printer,
                 b"document-format-supported",
                 TagEnum.mime_media_type,
-            ): [b"application/pdf"],
-            (SectionEnum.printer, b"printer-is-accepting-jobs", TagEnum.boolean): [
-                pack_bool(True)
+            ): list(DOCUMENT_FORMAT_SUPPORTED),
+            (SectionEnum.printer, b"queued-job-count", TagEnum.integer): [
+                pack_int(self.queued_job_count())
             ],
-            (SectionEnum.printer, b"queued-job-count", TagEnum.integer): [pack_int(0)],
             (SectionEnum.printer, b"pdl-override-supported", TagEnum.keyword): [
                 b"not-attempted"
             ],
             (SectionEnum.printer, b"printer-up-time", TagEnum.integer): [
                 pack_int(self.printer_uptime())
             ],
-            (SectionEnum.printer, b"compression-supported", TagEnum.keyword): [b"none"],
+            (SectionEnum.printer, b"compression-supported", TagEnum.keyword): list(
+                COMPRESSION_SUPPORTED
+            ),
             (SectionEnum.printer, b"media-supported", TagEnum.keyword): [b"roll_57mm"],
             (SectionEnum.printer, b"media-default", TagEnum.keyword): [b"roll_57mm"],
+            (SectionEnum.printer, b"dither-mode-supported", TagEnum.keyword): [
+                mode.encode("ascii") for mode in DITHER_MODES
+            ],
+            (SectionEnum.printer, b"dither-mode-default", TagEnum.keyword): [
+                self.default_dither_mode.encode("ascii")
+            ],
+            (SectionEnum.printer, b"job-priority-supported", TagEnum.integer): [
+                pack_int(100)
+            ],
+            (SectionEnum.printer, b"job-priority-default", TagEnum.integer): [
+                pack_int(DEFAULT_JOB_PRIORITY)
+            ],
             (SectionEnum.printer, b"printer-uuid", TagEnum.uri): [self.printer_uuid],
         }
+        attr.update(self.printer_state_attributes())
         attr.update(self.minimal_attributes())
         return attr
 
+    def printer_state_attributes(self):
+        """Текущее состояние принтера: printer-state, причины и приём заданий."""
+        return {
+            (SectionEnum.printer, b"printer-state", TagEnum.enum): [
+                pack_enum(3)
+            ],  # 3 = idle
+            (SectionEnum.printer, b"printer-state-reasons", TagEnum.keyword): [b"none"],
+            (SectionEnum.printer, b"printer-is-accepting-jobs", TagEnum.boolean): [
+                pack_bool(True)
+            ],
+        }
+
+    def accepting_jobs(self, req):
+        """Можно ли принять задание из запроса req."""
+        return True
+
+    def media_sizes(self):
+        """Размеры носителей принтера в пунктах: {имя: (ширина, высота)}."""
+        return {}
+
+    def preflight_job(self, req, document=None, complete=True):
+        """
+        Проверка задания до растеризации: поддерживаются ли сжатие и формат
+        документа, а если документ передан — его структура (preflight_document).
+        :return: None, если замечаний нет, иначе (статус IPP, сообщение).
+        """
+        compression = req.get_attribute(b"compression")
+        if compression not in (None,) + COMPRESSION_SUPPORTED:
+            return (
+                StatusCodeEnum.client_error_compression_not_supported,
+                f"Сжатие {compression.decode('ascii', 'replace')} не поддерживается",
+            )
+        document_format = req.get_attribute(b"document-format")
+        if document_format not in (None,) + DOCUMENT_FORMAT_SUPPORTED:
+            return (
+                StatusCodeEnum.client_error_document_format_not_supported,
+                f"Формат {document_format.decode('ascii', 'replace')} не поддерживается",
+            )
+        if document is None:
+            return None
+        return preflight_document(
+            document, document_format, self.media_sizes(), complete
+        )
+
+    def preflight_spooled_document(self, req, job):
+        """
+        Проверяет последний принятый документ задания прямо в очереди (mmap).
+        :return: (статус IPP, сообщение или None).
+        """
+        with job.open_document() as document:
+            problem = self.preflight_job(req, document)
+        return problem or (StatusCodeEnum.ok, None)
+
+    def spool_job(self, req, psfile):
+        """Создаёт задание в очереди на диске и сохраняет в него документ."""
+        job = self.spool.create_job(self.create_job(req), self.job_options(req))
+        try:
+            job.write_document(
+                self.document_stream(req, psfile), self.document_options(req)
+            )
+        except zlib.error:
+            job.remove()
+            raise
+        return job
+
+    @staticmethod
+    def document_stream(req, psfile):
+        """
+        Поток документа после заголовка IPP. Сжатый документ (атрибут
+        compression) распаковывается на лету, по мере чтения из запроса.
+        """
+        compression = req.get_attribute(b"compression")
+        if compression in (None, b"none"):
+            return psfile
+        return io.BufferedReader(DecompressingReader(psfile))
+
+    def open_job(self, job):
+        """Запоминает задание Create-Job, ожидающее следующий Send-Document."""
+
+    def take_open_job(self, job_id):
+        """Забирает открытое задание для Send-Document; None, если его нет."""
+        return None
+
+    def close_job(self, job):
+        """
+        Завершает задание: освобождает принтер и зарезервированные ресурсы и
+        удаляет задание из очереди.
+        """
+        self.release_job_printer(job)
+        self.release_job(job)
+        job.remove()
+
+    def admit_job(self, req, job):
+        """
+        Резервирует ресурсы под задание до release_job(); для уже допущенного
+        задания ничего не делает.
+        :return: False, если сервер занят.
+        """
+        return True
+
+    def release_job(self, job):
+        """Освобождает ресурсы, зарезервированные admit_job() для задания."""
+
+    def queued_job_count(self):
+        return 0
+
     def print_job_attributes(self, job_id, state, state_reasons):
         """Атрибуты конкретной печатной задачи (job)."""
         job_uri = b"%sjob/%d" % (self.base_uri, job_id)
@@ -472,145 +852,680 @@ class IPPPrinterMethod:
         # Возвращаем случайный job_id
         return random.randint(1, 9999)
 
-    def is_document(self, image, dark_threshold=50, light_threshold=200):
+    def handle_postscript(self, job, black_threshold=40, resolution=300):
         """
-        Проверяет, является ли изображение документом на основе гистограммы.
-        :param image: Объект изображения (Wand Image).
-        :param dark_threshold: Порог яркости для тёмных пикселей.
-        :param light_threshold: Порог яркости для светлых пикселей.
-        :return: True, если это документ; False, если это фотография.
+        Растеризует и кодирует ещё не обработанные документы задания из очереди
+        и печатает страницы, начиная с первой ненапечатанной. Каждая страница
+        печатается, как только готова, пока следующие ещё растеризуются. Пока
+        задание ждёт следующие документы, принтер остаётся за ним.
         """
-        # Убедимся, что изображение в режиме grayscale
-        with image.clone() as grayscale_img:
-            grayscale_img.type = "grayscale"
+        completed = False
+        profile = (
+            self.profiler.profile(job.job_id, f"handle-{job.rendered_documents}")
+            if job.options.get("profile")
+            else nullcontext()
+        )
+        try:
+            with profile:
+                # Страницы, закодированные до перезапуска сервера
+                self.print_pending_pages(job)
+                for index in range(job.rendered_documents, len(job.documents)):
+                    for page in self.render_spooled_document(
+                        job, index, black_threshold, resolution
+                    ):
+                        job.add_page(page)
+                        self.print_pending_pages(job)
+                    job.finish_document()
+            completed = True
+        finally:
+            if not completed or job.last_document:
+                self.release_job_printer(job)
+
+    def submit_render(self, job, stage, function, *args):
+        """
+        Отправляет задачу растеризации в пул процессов. Задачи профилируемого
+        задания выполняются в процессе пула под профилировщиком.
+        """
+        if job.options.get("profile"):
+            return self.render_executor.submit(
+                run_profiled,
+                self.profiler.path_prefix(job.job_id, stage),
+                function,
+                *args,
+            )
+        return self.render_executor.submit(function, *args)
+
+    def job_printer(self, job):
+        """
+        Принтер задания: занимается при первой готовой странице и остаётся
+        за заданием до его завершения, чтобы страницы печатались подряд.
+        """
+        ble_printer = self.held_printers.get(job.job_id)
+        if ble_printer is None:
+            target = self.target_printer(job.options["printer_uri"])
+            # Очередь к принтеру — по job-priority и оценке длины всего задания
+            ble_printer = acquire_ble_printer(
+                self.printer_pool,
+                target,
+                job.options.get("priority", DEFAULT_JOB_PRIORITY),
+                self.job_packets(job),
+            )
+            self.held_printers[job.job_id] = ble_printer
+        return ble_printer
+
+    def job_packets(self, job):
+        """
+        Ненапечатанный остаток задания в пакетах строк: закодированные страницы
+        плюс оценка ещё не закодированных по документам целиком.
+        """
+        packets = sum(page[1] for page in job.pages[job.printed_pages :])
+        # Страницы текущего документа, которые уже закодированы
+        encoded = sum(
+            page[1] for page in job.pages[len(job.pages) - job.document_pages :]
+        )
+        for index in range(job.rendered_documents, len(job.documents)):
+            with job.open_document(index) as document:
+                estimate = estimate_document_packets(
+                    document, spooled_document_format(job, index)
+                )
+            packets += max(0, estimate - encoded)
+            encoded = 0
+        return packets
+
+    def release_job_printer(self, job):
+        ble_printer = self.held_printers.pop(job.job_id, None)
+        if ble_printer is not None:
+            release_ble_printer(self.printer_pool, ble_printer)
+
+    def print_pending_pages(self, job):
+        """Печатает закодированные, но ещё не напечатанные страницы задания."""
+        if job.printed_pages == len(job.pages):
+            return
+        ble_printer = self.job_printer(job)
+        connection_manager = self.printer_pool.connection_manager(ble_printer)
+        for page_index in range(job.printed_pages, len(job.pages)):
+            # Пакеты страницы читаются из очереди через mmap по мере передачи
+            count = job.pages[page_index][1]
+            schedule_ble_print_job(
+                ble_printer, job.iter_packets(page_index), connection_manager, count
+            )
+            job.mark_printed(page_index + 1)
+            print(f"Страница {page_index + 1}: отправлена на печать...")
+
+    def render_spooled_document(self, job, index, black_threshold=40, resolution=300):
+        """
+        Растеризует и кодирует документ index задания, записывая пакеты в очередь.
+        Страницы, закодированные до перезапуска сервера, пропускаются.
+        :return: Генератор [имя файла, число пакетов, документ?] по страницам.
+        """
+        document_format = job.documents[index]["document_format"]
+        charset = job.documents[index]["charset"]
+        if document_format == LABEL_DOCUMENT_FORMAT.decode("ascii"):
+            # Этикетки рисуются сразу в 1-битный буфер, без Ghostscript
+            with job.open_document(index) as document:
+                pages = render_labels(bytes(document))[job.document_pages :]
+            yield from job.write_pages(pages)
+            return
+        if document_format == "text/plain":
+            from text_renderer import render_text_document
+
+            # Текст раскладывается из кэша готовых глифов, без Ghostscript
+            if job.document_pages == 0:
+                with job.open_document(index) as document:
+                    img = render_text_document(bytes(document), charset=charset)
+                yield from job.write_pages([BLEPrinter().generate_printer_data(img)])
+            return
+
+        with job.open_document(index) as document:
+            page_count, _page_size = document_pages(document)
+        # Номер файла первой страницы документа
+        first_page = len(job.pages) - job.document_pages
+        if page_count == 0:
+            # Число страниц неизвестно — растеризуем документ целиком одной задачей
+            future = self.submit_render(
+                job,
+                f"document-{index}",
+                render_document,
+                job.document_path(index),
+                job.directory,
+                black_threshold,
+                resolution,
+                job.options["dither_mode"],
+                first_page,
+                job.options.get("orientation", "none"),
+            )
+            yield from future.result()[job.document_pages :]
+            return
+
+        def submit(page_index):
+            return self.submit_render(
+                job,
+                f"document-{index}-page-{page_index}",
+                render_page,
+                job.document_path(index),
+                page_index,
+                page_count,
+                job.path(page_file_name(first_page + page_index)),
+                black_threshold,
+                resolution,
+                job.options["dither_mode"],
+                job.options.get("orientation", "none"),
+            )
+
+        # Каждая страница — отдельная задача пула: страницы растеризуются
+        # параллельно, а печать начинается с готовой первой. В работе не больше
+        # PAGES_IN_FLIGHT страниц — готовые страницы не копятся впереди печати
+        page_indexes = iter(range(job.document_pages, page_count))
+        window = min(self.render_workers, PAGES_IN_FLIGHT)
+        futures = collections.deque(map(submit, itertools.islice(page_indexes, window)))
+        try:
+            while futures:
+                page = futures.popleft().result()
+                if page is None:
+                    # Страниц меньше оценки — следующих тоже нет
+                    break
+                futures.extend(map(submit, itertools.islice(page_indexes, 1)))
+                yield page
+        finally:
+            # Печать прервана — остальные страницы уже не нужны
+            for future in futures:
+                future.cancel()
+
+
+# =====================
+# Контроль нагрузки
+# =====================
+
+
+# Размер страницы по умолчанию — этикетка 58x40 мм из PPD, в пунктах
+DEFAULT_PAGE_SIZE_PT = (465, 320)
+
+
+def document_pages(raw_data):
+    """
+    Число страниц и размер первой страницы (в пунктах) по структуре PDF/PS,
+    без растеризации. Число страниц 0 — определить не удалось (например,
+    объекты страниц PDF упакованы в сжатые потоки), размер None — в документе
+    его нет.
+
+    raw_data может быть mmap документа из очереди: используются только срезы и re.
+    """
+    if raw_data[:4] == b"%PDF":
+        pages = len(re.findall(rb"/Type\s*/Page\b", raw_data))
+        media_box = re.search(
+            rb"/MediaBox\s*\[\s*([-\d.]+)\s+([-\d.]+)\s+([-\d.]+)\s+([-\d.]+)",
+            raw_data,
+        )
+        if media_box:
+            x0, y0, x1, y1 = (float(v) for v in media_box.groups())
+            return pages, (abs(x1 - x0), abs(y1 - y0))
+        return pages, None
+    return len(re.findall(rb"%%Page:", raw_data)), None
+
+
+def spooled_document_format(job, index=-1):
+    """document-format документа задания из очереди (bytes, как в запросе)."""
+    document_format = job.documents[index]["document_format"]
+    return document_format and document_format.encode("ascii")
+
+
+def estimate_job_memory(raw_data, document_format=None, resolution=300):
+    """
+    Грубая оценка памяти, нужной на обработку документа: сам документ плюс
+    растр одной страницы в ImageMagick (Q16 RGBA — 8 байт на точку):
+    страницы растеризуются по одной (см. render_page).
+    """
+    if document_format in (b"text/plain", LABEL_DOCUMENT_FORMAT):
+        # Рендер сразу в 1-битный буфер шириной 384 точки
+        return len(raw_data) * 64
+
+    _pages, page_size = document_pages(raw_data)
+    page_size = page_size or DEFAULT_PAGE_SIZE_PT
+    width = page_size[0] / 72 * resolution
+    height = page_size[1] / 72 * resolution
+    return len(raw_data) + int(width * height * 8)
+
+
+# Ширина печатающей головки в точках; пакет строк — две строки точек
+PRINTER_WIDTH_DOTS = 384
+
+# Примерная высота строки текста (шрифт 20 пт) и этикетки в пакетах строк
+TEXT_LINE_PACKETS = 12
+LABEL_PACKETS = 96
+
+
+def estimate_document_packets(raw_data, document_format=None):
+    """
+    Грубая оценка длины документа в пакетах строк без растеризации: для
+    PDF/PS — число страниц на высоту страницы, приведённой к ширине головки;
+    для текста и этикеток — по числу строк документа.
+
+    raw_data может быть mmap документа из очереди, как в document_pages().
+    """
+    if document_format == b"text/plain":
+        return (len(re.findall(rb"\n", raw_data)) + 1) * TEXT_LINE_PACKETS
+    if document_format == LABEL_DOCUMENT_FORMAT:
+        # По этикетке на непустую строку (см. parse_label_document)
+        labels = len(re.findall(rb"^[ \t]*\S", raw_data, re.MULTILINE))
+        return max(1, labels) * LABEL_PACKETS
+
+    pages, page_size = document_pages(raw_data)
+    width, height = page_size or DEFAULT_PAGE_SIZE_PT
+    return max(1, pages) * -(-int(PRINTER_WIDTH_DOTS * height / width) // 2)
+
+
+class JobAdmission:
+    """
+    Ограничивает число одновременно обрабатываемых заданий и их суммарную
+    оценку памяти. Задание сверх лимита ждёт освобождения не дольше
+    hold_timeout секунд, после чего получает отказ (server-error-busy).
+    """
+
+    def __init__(self, max_jobs=4, memory_budget=None, hold_timeout=0):
+        self.max_jobs = max_jobs
+        self.memory_budget = memory_budget
+        self.hold_timeout = hold_timeout
+        self.active_jobs = 0
+        self.waiting_jobs = 0
+        self.reserved_memory = 0
+        self._condition = threading.Condition()
+
+    @property
+    def job_count(self):
+        """Задания в обработке и ожидающие допуска."""
+        return self.active_jobs + self.waiting_jobs
+
+    def _fits(self, cost):
+        if self.active_jobs >= self.max_jobs:
+            return False
+        if self.memory_budget is None or self.active_jobs == 0:
+            # Одно задание допускается всегда, даже если оно больше бюджета
+            return True
+        return self.reserved_memory + cost <= self.memory_budget
+
+    def acquire(self, cost):
+        with self._condition:
+            self.waiting_jobs += 1
+            try:
+                admitted = self._condition.wait_for(
+                    lambda: self._fits(cost), timeout=self.hold_timeout
+                )
+            finally:
+                self.waiting_jobs -= 1
+            if not admitted:
+                return False
+            self.active_jobs += 1
+            self.reserved_memory += cost
+            return True
 
-            # Получаем гистограмму (преобразуем значения в числа)
-            histogram = [int(color.red) for color in grayscale_img.histogram]
+    def release(self, cost):
+        with self._condition:
+            self.active_jobs -= 1
+            self.reserved_memory -= cost
+            self._condition.notify_all()
 
-            # Считаем общее количество пикселей
-            total_pixels = sum(histogram)
 
-            # Проверяем, есть ли пиксели вообще
-            if total_pixels == 0:
-                print("Гистограмма пустая: невозможно определить тип изображения.")
-                return False  # Считаем, что это не документ
+# =====================
+# Предварительная проверка документов (без Ghostscript)
+# =====================
 
-            # Считаем тёмные и светлые пиксели
-            dark_pixels = sum(
-                histogram[:dark_threshold]
-            )  # Пиксели с яркостью 0–dark_threshold
-            light_pixels = sum(
-                histogram[light_threshold:]
-            )  # Пиксели с яркостью light_threshold–255
 
-            # Определяем, является ли изображение документом
-            if (dark_pixels + light_pixels) / total_pixels > 0.85:
-                return True  # Это документ
-            return False  # Это фотография
+# Сколько байт от начала документа смотрит Validate-Job
+PREFLIGHT_HEAD_SIZE = 64 * 1024
+
+# Допуск при сравнении размера страницы с носителями из PPD, в пунктах
+PAGE_SIZE_TOLERANCE_PT = 2
+
+
+def sniff_document_format(head):
+    """Формат документа по сигнатуре в первых байтах; None — не опознан."""
+    # Перед PostScript драйверы иногда ставят Ctrl-D, BOM или пустые строки
+    head = bytes(head[:64]).lstrip(b"\x04\xef\xbb\xbf \t\r\n")
+    if head.startswith(b"%PDF-"):
+        return b"application/pdf"
+    if head.startswith(b"%!"):
+        return b"application/postscript"
+    return None
+
+
+def page_fits_media(page_size, media_sizes):
+    """Совпадает ли страница с одним из носителей PPD (в любой ориентации)."""
+    width, height = page_size
+    for media_width, media_height in media_sizes.values():
+        for w, h in ((media_width, media_height), (media_height, media_width)):
+            if (
+                abs(width - w) <= PAGE_SIZE_TOLERANCE_PT
+                and abs(height - h) <= PAGE_SIZE_TOLERANCE_PT
+            ):
+                return True
+    return False
+
+
+def preflight_document(raw_data, document_format, media_sizes, complete=True):
+    """
+    Проверяет документ по его структуре, не растеризуя: формат по сигнатуре,
+    целостность PDF, число страниц и размер первой страницы против носителей PPD.
+    Страница другого размера не ошибка — при печати она масштабируется.
+
+    :param raw_data: Документ (bytes или mmap из очереди) или только его начало.
+    :param complete: raw_data содержит документ целиком.
+    :return: None, если замечаний нет, иначе (статус IPP, сообщение).
+    """
+    if document_format == LABEL_DOCUMENT_FORMAT:
+        if not complete:
+            # По началу документа этикетки не проверить: строка может оборваться
+            return None
+        from label_renderer import validate_label_document
 
-    def handle_postscript(
-        self, ipp_request, postscript_file, black_threshold=40, resolution=300
+        try:
+            validate_label_document(bytes(raw_data))
+        except ValueError as e:
+            return StatusCodeEnum.client_error_document_format_error, str(e)
+        return None
+    if document_format == b"text/plain":
+        # Текст рисуется без Ghostscript, недекодируемые символы заменяются
+        return None
+
+    sniffed = sniff_document_format(raw_data)
+    if document_format in (None, b"application/octet-stream"):
+        if sniffed is None:
+            return (
+                StatusCodeEnum.client_error_document_format_not_supported,
+                "Формат документа не опознан",
+            )
+    elif sniffed != document_format:
+        return (
+            StatusCodeEnum.client_error_document_format_error,
+            f"Документ не является {document_format.decode('ascii', 'replace')}",
+        )
+    if sniffed != b"application/pdf":
+        return None
+
+    if complete and raw_data[-1024:].find(b"%%EOF") == -1:
+        return (
+            StatusCodeEnum.client_error_document_format_error,
+            "PDF обрезан: нет маркера %%EOF",
+        )
+    pages, page_size = document_pages(raw_data)
+    if complete and pages == 0 and raw_data.find(b"/ObjStm") == -1:
+        # Без сжатых потоков объектов страницы были бы найдены
+        return (
+            StatusCodeEnum.client_error_document_format_error,
+            "В PDF нет страниц",
+        )
+    logging.debug("Проверка PDF: страниц %d, размер %s", pages, page_size)
+    if (
+        page_size is not None
+        and media_sizes
+        and not page_fits_media(page_size, media_sizes)
     ):
-        # 1) Считываем всё содержимое из postscript_file (PS) в память
-        raw_data = postscript_file.read()
-
-        # Открываем весь PostScript документ как многостраничное изображение
-        with Image(blob=raw_data, resolution=resolution) as original_doc:
-            print(f"Количество страниц: {len(original_doc.sequence)}")
-
-            # Если несколько страниц - считаем, что это документ
-            page_count = len(original_doc.sequence)
-            is_multi_page = page_count > 1
-
-            # Итерация по каждой странице документа
-            for page_index, page in enumerate(original_doc.sequence):
-                print(f"Обработка страницы {page_index + 1}")
-
-                # Создаем объект Image для текущей страницы
-                with Image(image=page) as original_img:
-                    original_img.trim()
-
-                    # Проверка, является ли страница документом для обрезки
-                    if is_multi_page or self.is_document(original_img):
-                        print(
-                            "Изображение распознано как документ. Выполняется обрезка."
-                        )
-
-                        # Создаем копию для анализа в режиме grayscale
-                        with original_img.clone() as grayscale_img:
-                            grayscale_img.type = "grayscale"
-                            width, height = grayscale_img.width, grayscale_img.height
-
-                            # Экспортируем пиксели для анализа
-                            pixels = grayscale_img.export_pixels(
-                                x=0, y=0, width=width, height=height, channel_map="I"
-                            )
-
-                            # Инициализация координат крайних чёрных точек
-                            min_x, max_x = width, 0
-                            min_y, max_y = height, 0
-
-                            # Поиск чёрных пикселей
-                            for y in range(height):
-                                for x in range(width):
-                                    index = y * width + x
-                                    intensity = pixels[index]
-                                    if (
-                                        intensity < black_threshold
-                                    ):  # Порог яркости для чёрных пикселей
-                                        if x < min_x:
-                                            min_x = x
-                                        if x > max_x:
-                                            max_x = x
-                                        if y < min_y:
-                                            min_y = y
-                                        if y > max_y:
-                                            max_y = y
-
-                            # Проверяем, были ли найдены чёрные пиксели
-                            if min_x <= max_x and min_y <= max_y:
-                                # Рассчитываем новые размеры для обрезки
-                                crop_width = max_x - min_x + 1
-                                crop_height = max_y - min_y + 1
-
-                                # Обрезаем оригинальное изображение по рассчитанным координатам
-                                original_img.crop(
-                                    left=min_x,
-                                    top=min_y,
-                                    width=crop_width,
-                                    height=crop_height,
-                                )
-                                print(
-                                    f"Страница {page_index + 1}: Обрезка изображения до: {crop_width}x{crop_height}, координаты: ({min_x}, {min_y})"
-                                )
-                            else:
-                                print(
-                                    f"Страница {page_index + 1}: Чёрные пиксели не найдены; обрезка не требуется."
-                                )
-                    else:
-                        print(
-                            f"Страница {page_index + 1}: Изображение распознано как фотография. Обрезка не выполняется."
-                        )
-
-                    # Сохраняем обработанную страницу в памяти как PNG для отправки
-                    original_img.format = "png"
-                    # (Необязательно) Сохраняем для отладки на диск
-                    debug_filename = (
-                        f".debug_images/debug_cropped_image_page_{page_index + 1}.png"
-                    )
-                    original_img.save(filename=debug_filename)
-                    print(
-                        f"Страница {page_index + 1}: Изображение после обрезки сохранено как {debug_filename}"
-                    )
+        return (
+            StatusCodeEnum.successful_ok_ignored_or_substituted_attributes,
+            f"Страница {page_size[0]:g}x{page_size[1]:g} pt не совпадает "
+            "с носителем принтера и будет масштабирована",
+        )
+    return None
+
+
+# =====================
+# Растеризация документов (выполняется в пуле процессов)
+# =====================
+
 
-                    # Получаем PNG-байты текущей страницы
-                    png_bytes = BytesIO(original_img.make_blob("png"))
+def render_page(
+    document_path,
+    page_index,
+    page_count,
+    output_path,
+    black_threshold=40,
+    resolution=300,
+    dither_mode="auto",
+    orientation="none",
+):
+    """
+    Растеризует одну страницу документа и кодирует её в пакеты принтера.
+
+    Ghostscript получает только нужную страницу (filename[index]), поэтому
+    память процесса не растёт с числом страниц, а растр страницы освобождается
+    сразу после кодирования. Функция выполняется в процессе пула.
+    :return: [имя файла, число пакетов, документ?] или None, если такой
+             страницы в документе нет.
+    """
+    from wand.image import Image
+
+    print(f"Обработка страницы {page_index + 1} из {page_count}")
+    try:
+        original_img = Image(
+            filename=f"{document_path}[{page_index}]", resolution=resolution
+        )
+    except Exception:
+        # Число страниц оценивается по структуре PDF и может быть завышено:
+        # пропускается только страница, которой в документе действительно
+        # нет, остальные ошибки Ghostscript и ImageMagick — ошибки задания
+        if page_index == 0 or page_index < count_document_pages(document_path):
+            raise
+        print(f"Страница {page_index + 1} не найдена в документе.")
+        return None
+    with original_img:
+        # Если несколько страниц - считаем, что это документ
+        return encode_page(
+            original_img,
+            page_index,
+            page_count > 1,
+            output_path,
+            black_threshold,
+            dither_mode,
+            orientation,
+        )
 
-                    # 3) Передаём эти байты в асинхронный метод BLEPrinter
-                    schedule_ble_print_job(self.ble_printer, png_bytes)
-                    print(
-                        f"Страница {page_index + 1}: Файл конвертирован в PNG и отправлен на печать..."
+
+def count_document_pages(document_path):
+    """
+    Точное число страниц документа: ImageMagick читает только заголовки
+    страниц (ping), без растра. Функция выполняется в процессе пула.
+    """
+    from wand.image import Image
+
+    with Image.ping(filename=document_path) as img:
+        return len(img.sequence)
+
+
+def render_document(
+    document_path,
+    output_dir,
+    black_threshold=40,
+    resolution=300,
+    dither_mode="auto",
+    first_page=0,
+    orientation="none",
+):
+    """
+    Растеризует весь документ сразу, обрезает поля и кодирует каждую страницу
+    в пакеты принтера. Используется, когда число страниц не удалось определить
+    по структуре документа (см. render_page).
+
+    Функция выполняется в процессе пула: документ читается из очереди на диске,
+    пакеты страниц записываются в output_dir (нумерация файлов с first_page),
+    а обратно передаются только имена файлов.
+    :return: Список [имя файла, число пакетов, документ?] для каждой страницы.
+    """
+    from wand.image import Image
+
+    pages = []
+
+    # Открываем весь PostScript документ как многостраничное изображение
+    with Image(filename=document_path, resolution=resolution) as original_doc:
+        print(f"Количество страниц: {len(original_doc.sequence)}")
+
+        # Если несколько страниц - считаем, что это документ
+        page_count = len(original_doc.sequence)
+        is_multi_page = page_count > 1
+
+        # Итерация по каждой странице документа
+        for page_index, page in enumerate(original_doc.sequence):
+            print(f"Обработка страницы {page_index + 1}")
+
+            # Создаем объект Image для текущей страницы
+            with Image(image=page) as original_img:
+                name = page_file_name(first_page + page_index)
+                pages.append(
+                    encode_page(
+                        original_img,
+                        page_index,
+                        is_multi_page,
+                        os.path.join(output_dir, name),
+                        black_threshold,
+                        dither_mode,
+                        orientation,
                     )
+                )
+
+    return pages
+
+
+def encode_page(
+    original_img,
+    page_index,
+    is_multi_page,
+    output_path,
+    black_threshold=40,
+    dither_mode="auto",
+    orientation="none",
+):
+    """
+    Обрезает поля страницы Wand, если это документ, и записывает её пакеты
+    принтера в output_path, повернув страницу, если так выйдет меньше строк
+    (orientation="auto", см. BLEPrinter.fit_orientation).
+    :return: [имя файла, число пакетов, документ?]
+    """
+    original_img.trim()
+
+    # Страница классифицируется один раз, по уменьшенной копии;
+    # результат получает и кодировщик
+    document = classify_page(original_img)
+    # Проверка, является ли страница документом для обрезки
+    if is_multi_page or document:
+        print("Изображение распознано как документ. Выполняется обрезка.")
+
+        # Создаем копию для анализа в режиме grayscale
+        with original_img.clone() as grayscale_img:
+            grayscale_img.type = "grayscale"
+            width, height = grayscale_img.width, grayscale_img.height
+
+            # Экспортируем пиксели для анализа
+            pixels = grayscale_img.export_pixels(
+                x=0, y=0, width=width, height=height, channel_map="I"
+            )
+
+            # Инициализация координат крайних чёрных точек
+            min_x, max_x = width, 0
+            min_y, max_y = height, 0
+
+            # Поиск чёрных пикселей
+            for y in range(height):
+                for x in range(width):
+                    index = y * width + x
+                    intensity = pixels[index]
+                    if intensity < black_threshold:  # Порог яркости для чёрных пикселей
+                        if x < min_x:
+                            min_x = x
+                        if x > max_x:
+                            max_x = x
+                        if y < min_y:
+                            min_y = y
+                        if y > max_y:
+                            max_y = y
+
+            # Проверяем, были ли найдены чёрные пиксели
+            if min_x <= max_x and min_y <= max_y:
+                # Рассчитываем новые размеры для обрезки
+                crop_width = max_x - min_x + 1
+                crop_height = max_y - min_y + 1
+
+                # Обрезаем оригинальное изображение по рассчитанным координатам
+                original_img.crop(
+                    left=min_x,
+                    top=min_y,
+                    width=crop_width,
+                    height=crop_height,
+                )
+                print(
+                    f"Страница {page_index + 1}: Обрезка изображения до: {crop_width}x{crop_height}, координаты: ({min_x}, {min_y})"
+                )
+            else:
+                print(
+                    f"Страница {page_index + 1}: Чёрные пиксели не найдены; обрезка не требуется."
+                )
+    else:
+        print(
+            f"Страница {page_index + 1}: Изображение распознано как фотография. Обрезка не выполняется."
+        )
+
+    # Сохраняем обработанную страницу в памяти как PNG для отправки
+    original_img.format = "png"
+    # (Необязательно) Сохраняем для отладки на диск
+    debug_filename = f".debug_images/debug_cropped_image_page_{page_index + 1}.png"
+    original_img.save(filename=debug_filename)
+    print(
+        f"Страница {page_index + 1}: Изображение после обрезки сохранено как {debug_filename}"
+    )
+
+    # Получаем PNG-байты текущей страницы
+    png_bytes = BytesIO(original_img.make_blob("png"))
+
+    # Кодируем страницу и пишем пакеты в файл задания
+    _total, packets = BLEPrinter().iter_printer_data(
+        png_bytes, dither_mode=dither_mode, document=document, orientation=orientation
+    )
+    count = write_page_packets(output_path, packets)
+    return [os.path.basename(output_path), count, document]
+
+
+def classify_page(image):
+    """
+    Классифицирует страницу Wand как документ или фотографию тем же
+    классификатором, что и кодировщик (BLEPrinter.is_document), по уменьшенной
+    копии в оттенках серого: полноразмерная копия и гистограмма не строятся.
+    """
+    from PIL import Image as PillowImage
+
+    factor = max(1, int((image.width * image.height / CLASSIFY_PIXELS) ** 0.5))
+    # Клон разделяет пиксели с оригиналом до первого изменения; sample сразу
+    # делает его маленьким
+    with image.clone() as thumbnail:
+        thumbnail.sample(max(1, image.width // factor), max(1, image.height // factor))
+        thumbnail.depth = 8
+        gray = thumbnail.make_blob("gray")
+        size = (thumbnail.width, thumbnail.height)
+    return BLEPrinter.is_document(PillowImage.frombytes("L", size, gray))
+
+
+def warm_up_renderer():
+    """
+    Загружает Wand/ImageMagick и Pillow в процессе пула заранее,
+    чтобы первое задание не платило за инициализацию библиотек.
+    """
+    from wand.image import Image
+    from PIL import Image as PillowImage
+
+    with Image(width=1, height=1) as img:
+        img.make_blob("png")
+    PillowImage.new("1", (8, 8))
+    return multiprocessing.current_process().name
+
+
+def render_labels(raw_data):
+    """
+    Рисует документ этикеток (см. label_renderer.parse_label_document)
+    и кодирует каждую этикетку в пакеты принтера.
+    """
+    from label_renderer import render_label, parse_label_document
+
+    encoder = BLEPrinter()
+    return [
+        encoder.generate_printer_data(render_label(label_type, data))
+        for label_type, data in parse_label_document(raw_data)
+    ]
 
 
 # =====================
@@ -618,6 +1533,95 @@ class IPPPrinterMethod:
 # =====================
 
 
+class ChunkedReader(io.RawIOBase):
+    """Файловый объект поверх последовательности фрагментов тела запроса."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.pending = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self.pending:
+            self.pending = memoryview(next(self.chunks, b""))
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+class LimitedReader(io.RawIOBase):
+    """
+    Тело запроса с Content-Length: после length байт чтение возвращает конец
+    файла, а не ждёт данных от клиента в сокете.
+    """
+
+    def __init__(self, raw, length):
+        self.raw = raw
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.remaining <= 0:
+            return 0
+        data = self.raw.read(min(len(buffer), self.remaining))
+        self.remaining -= len(data)
+        buffer[: len(data)] = data
+        return len(data)
+
+
+class DecompressingReader(io.RawIOBase):
+    """
+    Потоковая распаковка документа, сжатого gzip или deflate (zlib или «сырой»
+    deflate — формат определяется по первым байтам). За один вызов
+    распаковывается не больше, чем помещается в буфер читающего.
+    """
+
+    def __init__(self, raw, chunk_size=64 * 1024):
+        self.raw = raw
+        self.chunk_size = chunk_size
+        self.decompressor = None
+
+    def readable(self):
+        return True
+
+    @staticmethod
+    def wbits(data):
+        if data[:2] == b"\x1f\x8b":
+            return 16 + zlib.MAX_WBITS  # gzip
+        if (
+            len(data) >= 2
+            and data[0] & 0x0F == 8
+            and (data[0] << 8 | data[1]) % 31 == 0
+        ):
+            return zlib.MAX_WBITS  # zlib
+        return -zlib.MAX_WBITS  # deflate без заголовка (RFC 1951)
+
+    def readinto(self, buffer):
+        while True:
+            if self.decompressor is not None and self.decompressor.eof:
+                return 0
+            data = None
+            if self.decompressor is not None:
+                data = self.decompressor.unconsumed_tail
+            if not data:
+                data = self.raw.read(self.chunk_size)
+            if not data:
+                if self.decompressor is None:
+                    return 0
+                raise zlib.error("сжатые данные оборвались")
+            if self.decompressor is None:
+                self.decompressor = zlib.decompressobj(self.wbits(data))
+            out = self.decompressor.decompress(data, len(buffer))
+            if out:
+                buffer[: len(out)] = out
+                return len(out)
+
+
 class IPPRequestHandler(BaseHTTPRequestHandler):
     default_request_version = "HTTP/1.1"
     protocol_version = "HTTP/1.1"
@@ -651,7 +1655,12 @@ class IPPRequestHandler(BaseHTTPRequestHandler):
     def parse_request(self):
         ret = BaseHTTPRequestHandler.parse_request(self)
         if "chunked" in self.headers.get("transfer-encoding", ""):
-            self.rfile = BytesIO(b"".join(self.read_chunked(self.rfile)))
+            # Тело читается по мере надобности: документ идёт из сокета сразу в очередь
+            self.rfile = io.BufferedReader(ChunkedReader(self.read_chunked(self.rfile)))
+        elif self.headers.get("content-length", "").isdigit():
+            self.rfile = io.BufferedReader(
+                LimitedReader(self.rfile, int(self.headers["content-length"]))
+            )
         self.close_connection = True
         return ret
 
@@ -742,7 +1751,25 @@ class PostscriptHandler(IPPPrinterMethod):
 
     version = (1, 1)
 
-    def __init__(self, connection_params):
+    def __init__(
+        self,
+        connection_params,
+        printers=("LX-D02",),
+        idle_timeout=None,
+        render_workers=None,
+        dither_mode="auto",
+        max_jobs=4,
+        memory_budget=None,
+        hold_timeout=0,
+        spool_dir="spool",
+        multiple_operation_timeout=120,
+        ble_write_mode="auto",
+        packets_per_write=1,
+        profiler=None,
+        shortest_first=False,
+        aging_interval=30,
+        orientation="none",
+    ):
         self.uri = "ipp://192.168.0.100:8095/"
         self.name = "Thermal Printer LX-D2 57mm 203 DPI"
         self.base_uri = self.uri.encode("ascii")
@@ -752,15 +1779,315 @@ class PostscriptHandler(IPPPrinterMethod):
             "urn:uuid:" + "884d7c0a-f449-45a7-8bbe-095e2943d313"
         ).encode("ascii")
         self.connection_params = connection_params
-        self.printer_connection = self.connect_to_printer(connection_params)
+        self.default_dither_mode = dither_mode
+        self.orientation = orientation
+        self.admission = JobAdmission(max_jobs, memory_budget, hold_timeout)
+        self.spool = JobSpool(spool_dir)
+        # Задания Create-Job, ожидающие документов: job-id -> (задание, таймер)
+        self.open_jobs = {}
+        self._jobs_lock = threading.Lock()
+        # Принтеры, которые задания держат между документами
+        self.held_printers = {}
+        # Резерв допуска заданий в обработке: job-id -> оценка памяти
+        self.admitted_jobs = {}
+        self.multiple_operation_timeout = multiple_operation_timeout
+        # Профилирование выбранных заданий (по умолчанию — только по job-profile)
+        self.profiler = profiler or JobProfiler()
         # PPD
         self.pdd = BasicPostscriptPPD("pdd/LX-D2-thermal_57mm_203dpi.ppd")
-        self.ble_printer = self.connect_to_printer(self.name)
+        # Носители из PPD для предварительной проверки документов (читаются один раз)
+        self._media_sizes = None
+        self.printer_pool = PrinterPool(
+            printers,
+            idle_timeout=idle_timeout,
+            write_mode=ble_write_mode,
+            packets_per_write=packets_per_write,
+            shortest_first=shortest_first,
+            aging_interval=aging_interval,
+        )
+        # Растеризация и кодирование выполняются в отдельных процессах (по умолчанию
+        # по числу ядер). spawn — потому что в процессе уже работают потоки.
+        self.render_workers = render_workers or os.cpu_count() or 1
+        self.render_executor = ProcessPoolExecutor(
+            max_workers=self.render_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        # Отдельный URI для каждого принтера пула: ipp/print/1, ipp/print/2, ...
+        self.printer_uris = [
+            b"%s/%d" % (self.printer_uri, index)
+            for index in range(1, len(self.printer_pool.printers) + 1)
+        ]
+
+    def warm_up(self):
+        """Запускает процессы растеризации и прогревает в них ImageMagick в фоне."""
+        futures = [
+            self.render_executor.submit(warm_up_renderer)
+            for _ in range(self.render_workers)
+        ]
+
+        def report():
+            try:
+                for future in futures:
+                    future.result()
+                logging.info(
+                    "Процессы растеризации готовы через %.3f с после запуска",
+                    time.monotonic() - START_TIME,
+                )
+            except Exception as e:
+                logging.error("Ошибка прогрева растеризации: %s", e)
 
-    def connect_to_printer(self, connection_params):
-        # Логика подключения к физическому принтеру или драйверу
-        ble_printer = BLEPrinter()
-        return ble_printer
+        threading.Thread(target=report, name="RenderWarmUp", daemon=True).start()
+
+    def recover_jobs(self):
+        """
+        Допечатывает в фоне задания, прерванные прошлой остановкой сервера.
+        Задание, которое не удалось напечатать, остаётся в очереди и
+        повторяется через RECOVERY_RETRY_INTERVAL секунд.
+        """
+        jobs = self.spool.unfinished_jobs()
+        if not jobs:
+            return
+        logging.info("Незавершённых заданий в очереди: %d", len(jobs))
+
+        def resume():
+            pending = jobs
+            while pending:
+                pending = [job for job in pending if not self.resume_job(job)]
+                if pending:
+                    logging.info(
+                        "Повтор %d заданий через %d с",
+                        len(pending),
+                        RECOVERY_RETRY_INTERVAL,
+                    )
+                    time.sleep(RECOVERY_RETRY_INTERVAL)
+
+        threading.Thread(target=resume, name="SpoolRecovery", daemon=True).start()
+
+    def resume_job(self, job):
+        """
+        Допечатывает задание из очереди после перезапуска.
+        :return: True, если задание завершено и удалено из очереди; False —
+            если его нужно повторить позже (сервер занят, принтер недоступен).
+        """
+        # Документы, не дошедшие до остановки, уже не придут
+        job.set_last_document()
+        problem = self.preflight_recovered_job(job)
+        if problem is not None:
+            # Испорченный документ не напечатается и при повторе
+            logging.error("Задание %d отброшено: %s", job.job_id, problem[1])
+            job.remove()
+            return True
+        # Восстановленное задание допускается наравне с новыми
+        if not self.admit_job(None, job):
+            return False
+        try:
+            logging.info(
+                "Возобновление задания %d со страницы %d",
+                job.job_id,
+                job.printed_pages + 1,
+            )
+            self.handle_postscript(job)
+        except Exception as e:
+            logging.error(
+                "Ошибка задания %d, оно остаётся в очереди: %s", job.job_id, e
+            )
+            return False
+        finally:
+            self.release_job(job)
+        job.remove()
+        return True
+
+    def preflight_recovered_job(self, job):
+        """
+        Проверяет ненапечатанные документы задания из очереди так же, как при
+        приёме (preflight_document).
+        :return: None или (статус IPP, сообщение) первого испорченного документа.
+        """
+        for index in range(job.rendered_documents, len(job.documents)):
+            with job.open_document(index) as document:
+                problem = preflight_document(
+                    document,
+                    spooled_document_format(job, index),
+                    self.media_sizes(),
+                )
+            if problem and problem[0] >= StatusCodeEnum.client_error_bad_request:
+                return problem
+        return None
+
+    def start_printer_pool(self):
+        """Запускает поиск принтеров и фоновые подключения в цикле событий BLE."""
+        asyncio.run_coroutine_threadsafe(self.printer_pool.start(), ble_loop)
+
+    @staticmethod
+    def job_attribute(ipp_request, name):
+        """Атрибут задания: из группы job, а если его там нет — из operation."""
+        value = ipp_request.get_attribute(name, SectionEnum.job)
+        if value is None:
+            value = ipp_request.get_attribute(name)
+        return value
+
+    def dither_mode(self, ipp_request):
+        """Режим дизеринга из атрибута задания dither-mode или режим сервера."""
+        value = self.job_attribute(ipp_request, b"dither-mode")
+        if value is not None and value.decode("ascii", "replace") in DITHER_MODES:
+            return value.decode("ascii")
+        return self.default_dither_mode
+
+    def job_options(self, ipp_request):
+        """Параметры задания, сохраняемые в очереди."""
+        printer_uri = ipp_request.get_attribute(b"printer-uri")
+        return {
+            "printer_uri": printer_uri and printer_uri.decode("ascii"),
+            "dither_mode": self.dither_mode(ipp_request),
+            "profile": self.profiler.wants(self.profile_requested(ipp_request)),
+            "priority": self.job_priority(ipp_request),
+            "orientation": self.orientation,
+        }
+
+    def job_priority(self, ipp_request):
+        """Приоритет из атрибута задания job-priority (1–100)."""
+        value = self.job_attribute(ipp_request, b"job-priority")
+        if value is None or len(value) != 4:
+            return DEFAULT_JOB_PRIORITY
+        return min(100, max(1, struct.unpack(">i", value)[0]))
+
+    def profile_requested(self, ipp_request):
+        """Запросил ли клиент профилирование атрибутом job-profile."""
+        value = self.job_attribute(ipp_request, b"job-profile")
+        return value in (pack_bool(True), b"true", b"yes", b"on")
+
+    @staticmethod
+    def document_options(ipp_request):
+        """Параметры документа (Print-Job или Send-Document), сохраняемые в очереди."""
+        document_format = ipp_request.get_attribute(b"document-format")
+        charset = ipp_request.get_attribute(b"attributes-charset") or b"utf-8"
+        return {
+            "document_format": document_format and document_format.decode("ascii"),
+            "charset": charset.decode("ascii"),
+        }
+
+    def open_job(self, job):
+        # Если следующий документ не придёт вовремя, задание прерывается
+        timer = threading.Timer(
+            self.multiple_operation_timeout, self.abort_open_job, (job.job_id,)
+        )
+        timer.daemon = True
+        with self._jobs_lock:
+            self.open_jobs[job.job_id] = (job, timer)
+        timer.start()
+
+    def take_open_job(self, job_id):
+        with self._jobs_lock:
+            job, timer = self.open_jobs.pop(job_id, (None, None))
+        if timer is not None:
+            timer.cancel()
+        return job
+
+    def abort_open_job(self, job_id):
+        job = self.take_open_job(job_id)
+        if job is not None:
+            logging.warning(
+                "Задание %d прервано: нет следующего документа за %d с",
+                job_id,
+                self.multiple_operation_timeout,
+            )
+            self.close_job(job)
+
+    def create_job(self, req):
+        # Номера заданий не повторяются и после перезапуска сервера
+        return self.spool.next_job_id()
+
+    def printer_state_attributes(self):
+        """Состояние по последним уведомлениям принтеров пула."""
+        printers = self.printer_pool.printers
+        statuses = [p.status for p in printers]
+        accepting = self.printer_pool.can_accept()
+
+        if not accepting:
+            state = 5  # stopped
+        elif any(self.printer_pool.is_busy(p) for p in printers):
+            state = 4  # processing
+        else:
+            state = 3  # idle
+
+        reasons = []
+        if any(status.paper_out for status in statuses):
+            reasons.append(
+                b"media-empty-error" if not accepting else b"media-empty-warning"
+            )
+        if any(
+            status.battery is not None and status.battery <= 20 for status in statuses
+        ):
+            reasons.append(b"marker-supply-low-warning")
+
+        # Заряд батареи каждого принтера как уровень «расходного материала»;
+        # -2 — уровень неизвестен (RFC 3805)
+        return {
+            (SectionEnum.printer, b"printer-state", TagEnum.enum): [pack_enum(state)],
+            (SectionEnum.printer, b"printer-state-reasons", TagEnum.keyword): reasons
+            or [b"none"],
+            (SectionEnum.printer, b"printer-is-accepting-jobs", TagEnum.boolean): [
+                pack_bool(accepting)
+            ],
+            (SectionEnum.printer, b"marker-names", TagEnum.name_without_language): [
+                b"battery %d" % index for index in range(1, len(printers) + 1)
+            ],
+            (SectionEnum.printer, b"marker-levels", TagEnum.integer): [
+                pack_int(-2 if status.battery is None else status.battery)
+                for status in statuses
+            ],
+            (SectionEnum.printer, b"marker-low-levels", TagEnum.integer): [
+                pack_int(20) for _ in statuses
+            ],
+            (SectionEnum.printer, b"marker-high-levels", TagEnum.integer): [
+                pack_int(100) for _ in statuses
+            ],
+        }
+
+    def accepting_jobs(self, req):
+        printer_uri = req.get_attribute(b"printer-uri")
+        return self.printer_pool.can_accept(
+            self.target_printer(printer_uri and printer_uri.decode("ascii"))
+        )
+
+    def job_cost(self, job):
+        """Оценка памяти под задание по последнему принятому документу."""
+        with job.open_document() as document:
+            return estimate_job_memory(document, spooled_document_format(job))
+
+    def admit_job(self, req, job):
+        with self._jobs_lock:
+            if job.job_id in self.admitted_jobs:
+                return True
+        # Многодокументное задание оценивается по первому документу
+        cost = self.job_cost(job)
+        if not self.admission.acquire(cost):
+            return False
+        with self._jobs_lock:
+            self.admitted_jobs[job.job_id] = cost
+        return True
+
+    def release_job(self, job):
+        with self._jobs_lock:
+            cost = self.admitted_jobs.pop(job.job_id, None)
+        if cost is not None:
+            self.admission.release(cost)
+
+    def queued_job_count(self):
+        return self.admission.job_count
+
+    def target_printer(self, printer_uri):
+        """
+        Определяет принтер пула по printer-uri задания.
+        Для общего URI возвращает None — задание получит любой свободный принтер.
+        """
+        if printer_uri is None:
+            return None
+        printer_uri = printer_uri.encode("ascii").rstrip(b"/")
+        for index, uri in enumerate(self.printer_uris):
+            if printer_uri.endswith(b"/" + uri[len(self.base_uri) :]):
+                return self.printer_pool.printers[index]
+        return None
 
     def expect_page_data_follows(self, ipp_request):
         # Возвращает True, если ожидаются ещё данные (PS, PDF и т.п.)
@@ -781,6 +2108,11 @@ class PostscriptHandler(IPPPrinterMethod):
         # Можно возвращать другую логику, если нужно
         return BasicPostscriptPPD("pdd/LX-D2-thermal_57mm_203dpi.ppd")
 
+    def media_sizes(self):
+        if self._media_sizes is None:
+            self._media_sizes = self.ppd.media_sizes()
+        return self._media_sizes
+
 
 # =====================
 # Сервер IPP
@@ -795,11 +2127,45 @@ class IPPServer(socketserver.ThreadingTCPServer):
         super().__init__(address, request_handler)
 
 
-def run_server(host="0.0.0.0", port=6310):
+def run_server(
+    host="0.0.0.0",
+    port=6310,
+    printers=("LX-D02",),
+    idle_timeout=None,
+    render_workers=None,
+    dither_mode="auto",
+    max_jobs=4,
+    memory_budget=None,
+    hold_timeout=0,
+    spool_dir="spool",
+    ble_write_mode="auto",
+    packets_per_write=1,
+    profiler=None,
+    shortest_first=False,
+    aging_interval=30,
+    orientation="none",
+):
     logging.basicConfig(level=logging.DEBUG)
     connection_params = (host, port)
-    server = IPPServer(
-        (host, port), IPPRequestHandler, PostscriptHandler(connection_params)
+    # Сначала открываем сокет: соединения клиентов ждут в очереди, пока
+    # создаётся обработчик, а не получают отказ
+    server = IPPServer((host, port), IPPRequestHandler, None)
+    server.postscript = PostscriptHandler(
+        connection_params,
+        printers,
+        idle_timeout=idle_timeout,
+        render_workers=render_workers,
+        dither_mode=dither_mode,
+        max_jobs=max_jobs,
+        memory_budget=memory_budget,
+        hold_timeout=hold_timeout,
+        spool_dir=spool_dir,
+        ble_write_mode=ble_write_mode,
+        packets_per_write=packets_per_write,
+        profiler=profiler,
+        shortest_first=shortest_first,
+        aging_interval=aging_interval,
+        orientation=orientation,
     )
     logging.info("Сервер запущен на %s:%d", host, port)
     # Запускаем отдельный поток с нашим циклом событий
@@ -807,6 +2173,15 @@ def run_server(host="0.0.0.0", port=6310):
         target=start_ble_loop, name="BLELoopThread", daemon=True
     )
     ble_thread.start()
+    # Подключаемся к принтерам и прогреваем ImageMagick в фоне,
+    # не дожидаясь первого задания
+    server.postscript.start_printer_pool()
+    server.postscript.warm_up()
+    server.postscript.recover_jobs()
+    logging.info(
+        "Сервер готов к приёму заданий через %.3f с после запуска",
+        time.monotonic() - START_TIME,
+    )
 
     try:
         server.serve_forever()
@@ -815,28 +2190,153 @@ def run_server(host="0.0.0.0", port=6310):
     finally:
         # Прежде чем останавливать цикл, вызываем disconnect() для BLE-принтера
         postscript_handler = server.postscript
-        if hasattr(postscript_handler, "ble_printer"):
+        if hasattr(postscript_handler, "printer_pool"):
             try:
-                # Планируем выполнение disconnect() в цикле событий BLE
+                # Останавливаем менеджеры соединений и отключаемся в цикле событий BLE
                 future = asyncio.run_coroutine_threadsafe(
-                    postscript_handler.ble_printer.disconnect(), ble_loop
+                    postscript_handler.printer_pool.stop(), ble_loop
                 )
                 # Ожидаем завершения задачи
                 future.result(
                     timeout=10
                 )  # можно указать таймаут для предотвращения бесконечного ожидания
-                logging.info("BLE-принтер успешно отключен.")
+                logging.info("BLE-принтеры успешно отключены.")
             except Exception as e:
                 logging.error("Ошибка при отключении BLE-принтера: %s", e)
 
         # Останавливаем сервер и закрываем соединения
         server.shutdown()
         server.server_close()
+        postscript_handler.render_executor.shutdown()
 
         # Останавливаем цикл событий BLE и завершаем поток
         ble_loop.call_soon_threadsafe(ble_loop.stop)
         ble_thread.join()
 
 
+def main():
+    parser = argparse.ArgumentParser(description="IPP сервер для BLE термопринтера")
+    parser.add_argument("--host", type=str, default="0.0.0.0", help="Адрес сервера")
+    parser.add_argument("--port", "-p", type=int, default=6310, help="Порт сервера")
+    parser.add_argument(
+        "--printer",
+        action="append",
+        dest="printers",
+        help="Имя или MAC-адрес BLE-принтера; повторите для пула из нескольких принтеров",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=None,
+        help="Отключаться от принтера после N секунд простоя (экономия батареи)",
+    )
+    parser.add_argument(
+        "--render-workers",
+        type=int,
+        default=None,
+        help="Число процессов для растеризации (по умолчанию — число ядер)",
+    )
+    parser.add_argument(
+        "--dither",
+        choices=DITHER_MODES,
+        default="auto",
+        help="Режим дизеринга по умолчанию (задание может переопределить его атрибутом dither-mode)",
+    )
+    parser.add_argument(
+        "--max-jobs",
+        type=int,
+        default=4,
+        help="Максимум одновременно обрабатываемых заданий",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        default=None,
+        help="Бюджет памяти на задания в МБ (оценка по размеру и числу страниц)",
+    )
+    parser.add_argument(
+        "--hold-timeout",
+        type=float,
+        default=0,
+        help="Сколько секунд задание ждёт свободного места, прежде чем получить отказ",
+    )
+    parser.add_argument(
+        "--spool-dir",
+        type=str,
+        default="spool",
+        help="Каталог очереди заданий на диске",
+    )
+    parser.add_argument(
+        "--ble-write",
+        choices=BLE_WRITE_MODES,
+        default="auto",
+        help="Запись в принтер: auto — без подтверждения, если принтер это поддерживает",
+    )
+    parser.add_argument(
+        "--packets-per-write",
+        type=int,
+        default=1,
+        help="Пакетов строк в одной записи BLE (1 — по одному, 0 — сколько поместится в MTU)",
+    )
+    parser.add_argument(
+        "--profile-jobs",
+        type=float,
+        default=0,
+        help="Доля заданий в процентах, профилируемых cProfile и tracemalloc (100 — все)",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        type=str,
+        default="profiles",
+        help="Каталог профилей заданий",
+    )
+    parser.add_argument(
+        "--profile-max-files",
+        type=int,
+        default=200,
+        help="Сколько последних файлов профилей хранить",
+    )
+    parser.add_argument(
+        "--shortest-first",
+        action="store_true",
+        help="Среди заданий равного приоритета первым печатать самое короткое",
+    )
+    parser.add_argument(
+        "--aging-interval",
+        type=float,
+        default=30,
+        help="Каждые N секунд ожидания принтера поднимают приоритет задания (0 — не поднимать)",
+    )
+    parser.add_argument(
+        "--orientation",
+        choices=ORIENTATION_MODES,
+        default="none",
+        help="auto — поворачивать страницу на 90°, если так выходит меньше строк печати",
+    )
+    args = parser.parse_args()
+    run_server(
+        args.host,
+        args.port,
+        printers=args.printers or ("LX-D02",),
+        idle_timeout=args.idle_timeout,
+        render_workers=args.render_workers,
+        dither_mode=args.dither,
+        max_jobs=args.max_jobs,
+        memory_budget=(
+            args.memory_budget * 1024 * 1024 if args.memory_budget is not None else None
+        ),
+        hold_timeout=args.hold_timeout,
+        spool_dir=args.spool_dir,
+        ble_write_mode=args.ble_write,
+        packets_per_write=args.packets_per_write,
+        profiler=JobProfiler(
+            args.profile_dir, args.profile_jobs, args.profile_max_files
+        ),
+        shortest_first=args.shortest_first,
+        aging_interval=args.aging_interval,
+        orientation=args.orientation,
+    )
+
+
 if __name__ == "__main__":
-    run_server()
+    main()
@@ -0,0 +1,129 @@
+"""
+Профилирование отдельных заданий.
+
+Задание профилируется по атрибуту job-profile или случайно с заданной долей
+(флаг сервера). Обработка такого задания и каждая его задача растеризации в
+процессах пула выполняются под cProfile и tracemalloc, результаты пишутся в
+каталог профилей: job-<id>-<стадия>.prof (читается pstats / snakeviz) и
+job-<id>-<стадия>-memory.txt. В каталоге остаются только последние max_files
+файлов. Задания без профилирования этот модуль не затрагивает.
+"""
+
+import os
+import time
+import logging
+import random
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# Сколько строк кода с наибольшим объёмом выделенной памяти попадает в отчёт
+MEMORY_TOP = 25
+
+# cProfile (с Python 3.12) и tracemalloc общие на процесс: одновременно
+# профилируется один блок, пересекающиеся с ним выполняются без профиля —
+# иначе cProfile отказывает, а пик памяти смешивает разные задания
+_profiling_lock = threading.Lock()
+
+
+def write_memory_report(path, snapshot, peak, elapsed):
+    """Пишет время стадии, пик памяти и строки, выделившие больше всего памяти."""
+    stats = snapshot.filter_traces(
+        (tracemalloc.Filter(False, tracemalloc.__file__),)
+    ).statistics("lineno")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"Время: {elapsed:.3f} с\n")
+        f.write(f"Пик памяти: {peak / 2**20:.1f} МБ\n\n")
+        for stat in stats[:MEMORY_TOP]:
+            f.write(f"{stat}\n")
+
+
+@contextmanager
+def profiled(path_prefix):
+    """
+    Выполняет блок под cProfile и tracemalloc и пишет результаты в файлы
+    path_prefix.prof и path_prefix-memory.txt.
+
+    Если в процессе уже профилируется другой блок (или профилировщик занят
+    сторонним инструментом), блок выполняется без профилирования.
+    """
+    if not _profiling_lock.acquire(blocking=False):
+        logging.warning("Профиль %s пропущен: уже идёт профилирование", path_prefix)
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        _profiling_lock.release()
+        logging.warning("Профиль %s пропущен: %s", path_prefix, e)
+        yield
+        return
+    try:
+        tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - started
+            snapshot = tracemalloc.take_snapshot()
+            _current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+    finally:
+        _profiling_lock.release()
+    profiler.dump_stats(path_prefix + ".prof")
+    write_memory_report(path_prefix + "-memory.txt", snapshot, peak, elapsed)
+
+
+def run_profiled(path_prefix, function, *args):
+    """Вызывает function(*args) под профилировщиком (задача пула процессов)."""
+    with profiled(path_prefix):
+        return function(*args)
+
+
+class JobProfiler:
+    """Выбор профилируемых заданий и каталог их профилей."""
+
+    def __init__(self, directory="profiles", sample_percent=0, max_files=200):
+        self.directory = directory
+        self.sample_percent = sample_percent
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    def wants(self, requested=False):
+        """Профилировать ли новое задание: по запросу клиента или по доле заданий."""
+        return requested or random.random() * 100 < self.sample_percent
+
+    def path_prefix(self, job_id, stage):
+        """Путь к файлам профиля стадии задания без расширения."""
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, f"job-{job_id}-{stage}")
+
+    @contextmanager
+    def profile(self, job_id, stage):
+        """Профилирует блок как стадию задания; затем прореживает каталог."""
+        try:
+            with profiled(self.path_prefix(job_id, stage)):
+                yield
+        finally:
+            self.prune()
+
+    def prune(self):
+        """Удаляет самые старые файлы профилей сверх max_files."""
+        with self._lock:
+            try:
+                paths = [
+                    os.path.join(self.directory, name)
+                    for name in os.listdir(self.directory)
+                    if name.startswith("job-")
+                ]
+                paths.sort(key=os.path.getmtime)
+            except OSError:
+                return
+            for path in paths[: max(0, len(paths) - self.max_files)]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
@@ -0,0 +1,262 @@
+"""
+Очередь заданий на диске.
+
+Каждое задание хранится в своём каталоге spool/job-<id>: документы клиента
+(в задании Create-Job их может быть несколько), закодированные пакеты страниц
+и файл job.json с параметрами и прогрессом.
+Стадии растеризации и передачи читают файлы через mmap, поэтому большие
+задания не держатся в памяти целиком, а после перезапуска сервера
+незавершённые задания можно продолжить с последней напечатанной страницы.
+"""
+
+import os
+import json
+import mmap
+import shutil
+import threading
+from contextlib import contextmanager
+
+JOB_META = "job.json"
+NEXT_JOB_ID = "next-job-id"
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+def page_file_name(index):
+    """Имя файла с пакетами страницы index внутри каталога задания."""
+    return f"page-{index}.bin"
+
+
+def write_page_packets(path, packets):
+    """
+    Записывает пакеты страницы (строки HEX) подряд в двоичный файл.
+    :return: Число записанных пакетов.
+    """
+    count = 0
+    with open(path, "wb") as f:
+        for packet in packets:
+            f.write(bytes.fromhex(packet))
+            count += 1
+    return count
+
+
+def iter_page_packets(path, count):
+    """Читает пакеты страницы через mmap и отдаёт их строками HEX по одному."""
+    if count == 0:
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        packet_size = len(mm) // count
+        for offset in range(0, packet_size * count, packet_size):
+            yield mm[offset : offset + packet_size].hex()
+
+
+class SpooledJob:
+    """Задание в очереди на диске."""
+
+    def __init__(self, directory, meta):
+        self.directory = directory
+        self.meta = meta
+
+    @property
+    def job_id(self):
+        return self.meta["job_id"]
+
+    @property
+    def options(self):
+        """Параметры задания из запроса (дизеринг, принтер)."""
+        return self.meta["options"]
+
+    @property
+    def documents(self):
+        """Параметры принятых документов (формат, кодировка) по порядку."""
+        return self.meta["documents"]
+
+    @property
+    def last_document(self):
+        """Приняты ли все документы задания."""
+        return self.meta["last_document"]
+
+    def set_last_document(self):
+        self.meta["last_document"] = True
+        self.save()
+
+    @property
+    def state(self):
+        return self.meta["state"]
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def document_path(self, index=None):
+        """Путь к документу index; по умолчанию — к последнему принятому."""
+        if index is None:
+            index = len(self.documents) - 1
+        return self.path(f"document-{index}")
+
+    def write_document(self, stream, options, last=True):
+        """
+        Потоково копирует очередной документ клиента на диск.
+        Пустой документ (Send-Document, закрывающий задание) не сохраняется.
+        :return: True, если документ добавлен в задание.
+        """
+        path = self.document_path(len(self.documents))
+        with open(path, "wb") as f:
+            shutil.copyfileobj(stream, f, COPY_CHUNK_SIZE)
+        added = os.path.getsize(path) > 0
+        if added:
+            self.documents.append(options)
+        else:
+            os.remove(path)
+        self.meta["last_document"] = last
+        self.save()
+        return added
+
+    def discard_last_document(self):
+        """Убирает последний принятый документ: клиент отправит его повторно."""
+        os.remove(self.document_path())
+        self.documents.pop()
+        self.meta["last_document"] = False
+        self.save()
+
+    @contextmanager
+    def open_document(self, index=None):
+        """Отображает документ в память (mmap) только для чтения."""
+        path = self.document_path(index)
+        if os.path.getsize(path) == 0:
+            yield b""
+            return
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield mm
+
+    @property
+    def pages(self):
+        """
+        Закодированные страницы всех документов: список
+        [имя файла, число пакетов, документ?]; классификация страницы
+        документ/фото сохраняется вместе с ней.
+        """
+        return self.meta["pages"]
+
+    @property
+    def rendered_documents(self):
+        """Число документов, страницы которых уже закодированы."""
+        return self.meta["rendered_documents"]
+
+    @property
+    def document_pages(self):
+        """Число закодированных страниц документа, который кодируется сейчас."""
+        return self.meta["document_pages"]
+
+    def write_pages(self, pages, document=True):
+        """
+        Записывает пакеты страниц (списки строк HEX) в файлы задания.
+        :param document: Результат классификации страниц документ/фото.
+        :return: Список [имя файла, число пакетов, документ?] для add_page().
+        """
+        written = []
+        for index, packets in enumerate(pages, start=len(self.pages)):
+            name = page_file_name(index)
+            count = write_page_packets(self.path(name), packets)
+            written.append([name, count, document])
+        return written
+
+    def add_page(self, page):
+        """Добавляет очередную закодированную страницу текущего документа."""
+        self.pages.append(list(page))
+        self.meta["document_pages"] += 1
+        self.meta["state"] = "encoded"
+        self.save()
+
+    def finish_document(self):
+        """Отмечает, что все страницы текущего документа закодированы."""
+        self.meta["rendered_documents"] += 1
+        self.meta["document_pages"] = 0
+        self.save()
+
+    def iter_packets(self, page_index):
+        name, count = self.pages[page_index][:2]
+        return iter_page_packets(self.path(name), count)
+
+    @property
+    def printed_pages(self):
+        return self.meta["printed_pages"]
+
+    def mark_printed(self, pages):
+        self.meta["printed_pages"] = pages
+        self.meta["state"] = "printing"
+        self.save()
+
+    def save(self):
+        # Пишем во временный файл и подменяем: job.json не бывает недописанным
+        tmp_path = self.path(JOB_META + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self.path(JOB_META))
+
+    def remove(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class JobSpool:
+    """Каталог очереди заданий."""
+
+    def __init__(self, directory="spool"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def next_job_id(self):
+        """Выдаёт следующий номер задания; счётчик переживает перезапуск."""
+        with self._lock:
+            path = os.path.join(self.directory, NEXT_JOB_ID)
+            try:
+                with open(path, "r", encoding="ascii") as f:
+                    job_id = int(f.read().strip() or 1)
+            except (OSError, ValueError):
+                job_id = 1
+            with open(path, "w", encoding="ascii") as f:
+                f.write(str(job_id + 1))
+            return job_id
+
+    def create_job(self, job_id, options):
+        directory = os.path.join(self.directory, f"job-{job_id}")
+        os.makedirs(directory, exist_ok=True)
+        job = SpooledJob(
+            directory,
+            {
+                "job_id": job_id,
+                "state": "receiving",
+                "options": options,
+                "documents": [],
+                "last_document": False,
+                "pages": [],
+                "rendered_documents": 0,
+                "document_pages": 0,
+                "printed_pages": 0,
+            },
+        )
+        job.save()
+        return job
+
+    def unfinished_jobs(self):
+        """
+        Задания, оставшиеся после прошлого запуска, по возрастанию номера.
+        Задания без единого полностью принятого документа удаляются.
+        """
+        jobs = []
+        for name in os.listdir(self.directory):
+            directory = os.path.join(self.directory, name)
+            meta_path = os.path.join(directory, JOB_META)
+            if not name.startswith("job-") or not os.path.isfile(meta_path):
+                continue
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    job = SpooledJob(directory, json.load(f))
+            except (OSError, ValueError):
+                shutil.rmtree(directory, ignore_errors=True)
+                continue
+            if not job.documents:
+                job.remove()
+                continue
+            jobs.append(job)
+        return sorted(jobs, key=lambda job: job.job_id)
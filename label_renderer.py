@@ -0,0 +1,290 @@
+"""
+Прямой рендер штрих-кодов и QR-кодов в 1-битное изображение шириной печатающей головки.
+
+Модули кода рисуются целым числом точек принтера, поэтому этикетка не проходит
+через Ghostscript, масштабирование и дизеринг и сканируется надёжнее.
+"""
+
+from PIL import Image, ImageDraw
+
+PRINTER_WIDTH = 384
+
+# Зоны тишины с каждой стороны кода, в модулях: 10X для Code128 и EAN-13,
+# 4 модуля для QR
+LINEAR_QUIET = 10
+QR_QUIET = 4
+
+# Ширины штрихов/пробелов Code128 для значений 0..106 (106 — STOP без финального штриха)
+CODE128_PATTERNS = [
+    "212222", "222122", "222221", "121223", "121322", "131222", "122213",
+    "122312", "132212", "221213", "221312", "231212", "112232", "122132",
+    "122231", "113222", "123122", "123221", "223211", "221132", "221231",
+    "213212", "223112", "312131", "311222", "321122", "321221", "312212",
+    "322112", "322211", "212123", "212321", "232121", "111323", "131123",
+    "131321", "112313", "132113", "132311", "211313", "231113", "231311",
+    "112133", "112331", "132131", "113123", "113321", "133121", "313121",
+    "211331", "231131", "213113", "213311", "213131", "311123", "311321",
+    "331121", "312113", "312311", "332111", "314111", "221411", "431111",
+    "111224", "111422", "121124", "121421", "141122", "141221", "112214",
+    "112412", "122114", "122411", "142112", "142211", "241211", "221114",
+    "413111", "241112", "134111", "111242", "121142", "121241", "114212",
+    "124112", "124211", "411212", "421112", "421211", "212141", "214121",
+    "412121", "111143", "111341", "131141", "114113", "114311", "411113",
+    "411311", "113141", "114131", "311141", "411131", "211412", "211214",
+    "211232", "2331112",
+]  # fmt: skip
+
+CODE128_START_B = 104
+CODE128_START_C = 105
+CODE128_CODE_B = 100
+CODE128_CODE_C = 99
+CODE128_STOP = 106
+
+# Кодирование цифр EAN-13: наборы L, G, R и чётность первой цифры
+EAN_L = ["0001101", "0011001", "0010011", "0111101", "0100011",
+         "0110001", "0101111", "0111011", "0110111", "0001011"]  # fmt: skip
+EAN_G = ["0100111", "0110011", "0011011", "0100001", "0011101",
+         "0111001", "0000101", "0010001", "0001001", "0010111"]  # fmt: skip
+EAN_R = ["1110010", "1100110", "1101100", "1000010", "1011100",
+         "1001110", "1010000", "1000100", "1001000", "1110100"]  # fmt: skip
+EAN_PARITY = ["LLLLLL", "LLGLGG", "LLGGLG", "LLGGGL", "LGLLGG",
+              "LGGLLG", "LGGGLL", "LGLGLG", "LGLGGL", "LGGLGL"]  # fmt: skip
+
+LABEL_TYPES = ("code128", "ean13", "qr")
+
+
+def code128_values(data):
+    """
+    Кодирует строку в значения символов Code128 (без контрольного символа).
+    Серии из 4 и более цифр кодируются набором C (по две цифры в символе),
+    остальное — набором B.
+    """
+    values = []
+    current = None
+    i = 0
+    while i < len(data):
+        run = 0
+        while i + run < len(data) and data[i + run].isdigit():
+            run += 1
+        if run >= 4 or (run == len(data) - i and run >= 2 and run % 2 == 0):
+            # Нечётную серию начинаем одной цифрой в наборе B
+            if run % 2:
+                if current != "B":
+                    values.append(
+                        CODE128_START_B if current is None else CODE128_CODE_B
+                    )
+                    current = "B"
+                values.append(ord(data[i]) - 32)
+                i += 1
+                run -= 1
+            if current != "C":
+                values.append(CODE128_START_C if current is None else CODE128_CODE_C)
+                current = "C"
+            for j in range(i, i + run, 2):
+                values.append(int(data[j : j + 2]))
+            i += run
+            continue
+
+        char = data[i]
+        if not 32 <= ord(char) <= 127:
+            raise ValueError(f"Символ {char!r} не поддерживается Code128 (набор B).")
+        if current != "B":
+            values.append(CODE128_START_B if current is None else CODE128_CODE_B)
+            current = "B"
+        values.append(ord(char) - 32)
+        i += 1
+    return values
+
+
+def code128_modules(data):
+    """Возвращает последовательность модулей Code128: строка из '1' (штрих) и '0'."""
+    values = code128_values(data)
+    checksum = values[0]
+    for position, value in enumerate(values[1:], start=1):
+        checksum += position * value
+    values.append(checksum % 103)
+    values.append(CODE128_STOP)
+
+    modules = []
+    for value in values:
+        for index, width in enumerate(CODE128_PATTERNS[value]):
+            modules.append(("1" if index % 2 == 0 else "0") * int(width))
+    return "".join(modules)
+
+
+def ean13_checksum(digits):
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits[:12]))
+    return str((10 - total % 10) % 10)
+
+
+def ean13_modules(data):
+    """Возвращает модули EAN-13. Принимает 12 цифр (контрольная дописывается) или 13."""
+    if not data.isdigit() or len(data) not in (12, 13):
+        raise ValueError("EAN-13 требует 12 или 13 цифр.")
+    checksum = ean13_checksum(data)
+    if len(data) == 13 and data[12] != checksum:
+        raise ValueError(f"Неверная контрольная цифра EAN-13, ожидается {checksum}.")
+    digits = data[:12] + checksum
+
+    parity = EAN_PARITY[int(digits[0])]
+    left = "".join(
+        (EAN_L if p == "L" else EAN_G)[int(d)] for p, d in zip(parity, digits[1:7])
+    )
+    right = "".join(EAN_R[int(d)] for d in digits[7:])
+    return "101" + left + "01010" + right + "101"
+
+
+def qr_matrix(data):
+    """Матрица QR-кода (список строк из bool) без рамки тишины."""
+    import qrcode
+
+    qr = qrcode.QRCode(border=0, error_correction=qrcode.constants.ERROR_CORRECT_M)
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+def module_size(modules, width=PRINTER_WIDTH, quiet=LINEAR_QUIET):
+    """
+    Наибольший целый размер модуля в точках, при котором код из modules
+    модулей вместе с зонами тишины по quiet модулей помещается в width.
+
+    :raises ValueError: Код не помещается даже с модулем в одну точку.
+    """
+    size = width // (modules + 2 * quiet)
+    if size < 1:
+        raise ValueError("Код не помещается в ширину печатающей головки.")
+    return size
+
+
+def render_linear(
+    modules, text=None, width=PRINTER_WIDTH, height=120, quiet=LINEAR_QUIET
+):
+    """
+    Рисует линейный штрих-код целым числом точек на модуль.
+
+    :param modules: Строка модулей ('1' — штрих).
+    :param text: Подпись под штрих-кодом.
+    :param quiet: Ширина зоны тишины с каждой стороны, в модулях.
+    :return: Изображение в режиме "1" шириной width.
+    """
+    module_width = module_size(len(modules), width, quiet)
+    text_height = 14 if text else 0
+    img = Image.new("1", (width, height + text_height), 1)
+    draw = ImageDraw.Draw(img)
+
+    left = (width - module_width * len(modules)) // 2
+    x = left
+    for bit, group in _runs(modules):
+        run_width = group * module_width
+        if bit == "1":
+            draw.rectangle((x, 0, x + run_width - 1, height - 1), fill=0)
+        x += run_width
+
+    if text:
+        text_width = draw.textlength(text)
+        draw.text(((width - text_width) // 2, height + 2), text, fill=0)
+    return img
+
+
+def render_qr(data, width=PRINTER_WIDTH, quiet=QR_QUIET):
+    """Рисует QR-код максимальным целым размером модуля, помещающимся в ширину."""
+    matrix = qr_matrix(data)
+    size = len(matrix)
+    module = module_size(size, width, quiet)
+    side = module * (size + 2 * quiet)
+    img = Image.new("1", (width, side), 1)
+    draw = ImageDraw.Draw(img)
+    offset_x = (width - module * size) // 2
+    offset_y = quiet * module
+    for row, line in enumerate(matrix):
+        y = offset_y + row * module
+        for col, dark in enumerate(line):
+            if dark:
+                x = offset_x + col * module
+                draw.rectangle((x, y, x + module - 1, y + module - 1), fill=0)
+    return img
+
+
+def render_label(label_type, data, width=PRINTER_WIDTH):
+    """
+    Рисует этикетку заданного типа.
+
+    :param label_type: code128, ean13 или qr.
+    :param data: Содержимое кода.
+    :return: Изображение в режиме "1" шириной width.
+    """
+    if label_type == "code128":
+        return render_linear(code128_modules(data), text=data, width=width)
+    if label_type == "ean13":
+        modules = ean13_modules(data)
+        return render_linear(
+            modules, text=data[:12] + ean13_checksum(data), width=width
+        )
+    if label_type == "qr":
+        return render_qr(data, width=width)
+    raise ValueError(f"Неизвестный тип этикетки: {label_type}")
+
+
+def validate_label(label_type, data, width=PRINTER_WIDTH):
+    """
+    Проверяет данные этикетки, не рисуя её: допустимые символы, длину и
+    контрольную цифру кода, а также что код помещается в ширину головки
+    (тем же module_size, что и при рендере).
+
+    :raises ValueError: Этикетку нельзя напечатать.
+    """
+    if not data:
+        raise ValueError("Пустые данные этикетки.")
+    if label_type == "qr":
+        module_size(len(qr_matrix(data)), width, QR_QUIET)
+    elif label_type == "ean13":
+        module_size(len(ean13_modules(data)), width, LINEAR_QUIET)
+    elif label_type == "code128":
+        module_size(len(code128_modules(data)), width, LINEAR_QUIET)
+    else:
+        raise ValueError(f"Неизвестный тип этикетки: {label_type}")
+
+
+def validate_label_document(raw_data):
+    """
+    Разбирает документ этикеток и проверяет каждую этикетку (validate_label).
+
+    :raises ValueError: Документ не в UTF-8 или этикетку нельзя напечатать;
+                        в сообщении — номер этикетки.
+    """
+    for index, (label_type, data) in enumerate(parse_label_document(raw_data), 1):
+        try:
+            validate_label(label_type, data)
+        except ValueError as e:
+            raise ValueError(f"Этикетка {index}: {e}") from e
+
+
+def parse_label_document(raw_data):
+    """
+    Разбирает документ этикеток: по одной этикетке на строку в виде «тип:данные»,
+    например «code128:ABC-123» или «qr:https://example.com». Строка без типа
+    печатается как Code128.
+
+    :return: Список пар (тип, данные).
+    """
+    labels = []
+    for line in raw_data.decode("utf-8").splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        label_type, sep, data = line.partition(":")
+        if sep and label_type.lower() in LABEL_TYPES:
+            labels.append((label_type.lower(), data))
+        else:
+            labels.append(("code128", line))
+    return labels
+
+
+def _runs(modules):
+    """Группирует одинаковые соседние модули: '1110' -> ('1', 3), ('0', 1)."""
+    start = 0
+    for i in range(1, len(modules) + 1):
+        if i == len(modules) or modules[i] != modules[start]:
+            yield modules[start], i - start
+            start = i
@@ -1,14 +1,79 @@
 import asyncio
 import argparse
-from bleak import BleakClient, BleakScanner
-from bleak.exc import BleakDBusError
-from PIL import Image
+import glob
+import re
+import sys
+import time
+
+# bleak и Pillow импортируются при первом использовании, чтобы IPP-сервер
+# запускался быстрее
+from dithering import DITHER_MODES, dither
+
+# Таблица инверсии бит: в режиме "1" Pillow бит 1 означает белую точку
+INVERT_BITS = bytes(255 - i for i in range(256))
+
+# Размер уменьшенной копии (в точках) для классификации документ/фото
+CLASSIFY_PIXELS = 64 * 1024
+
+MAC_ADDRESS_RE = re.compile(r"^([0-9A-Fa-f]{2}[:-]){5}[0-9A-Fa-f]{2}$")
+
+# Режимы записи в характеристику принтера: auto — без подтверждения, если
+# характеристика это поддерживает; response — всегда с подтверждением
+BLE_WRITE_MODES = ("auto", "response")
+
+# Полезная нагрузка записи GATT при MTU по умолчанию (23 - 3 байта заголовка ATT)
+DEFAULT_WRITE_SIZE = 20
+
+# Сколько ждать ответа принтера на команду и уведомления о конце печати, в секундах
+COMMAND_TIMEOUT = 5
+PRINT_COMPLETION_TIMEOUT = 120
+
+# Приоритет задания по умолчанию (IPP job-priority: 1 — низший, 100 — высший)
+DEFAULT_JOB_PRIORITY = 50
+
+# На сколько поднимается приоритет задания за каждый интервал ожидания принтера
+AGING_STEP = 10
+
+# Ориентация при печати: none — как есть; auto — поворот на 90°, если так
+# выходит меньше строк печатающей головки (см. BLEPrinter.fit_orientation)
+ORIENTATION_MODES = ("none", "auto")
+
+# Поворот не уменьшает изображение больше чем вдвое по сравнению с исходной
+# ориентацией: модуль штрих-кода в 2 точки остаётся не меньше точки
+MIN_ROTATED_SCALE = 0.5
+
+# Яркость, начиная с которой точка считается полем при обрезке (--trim)
+TRIM_WHITE_LEVEL = 250
+
+
+class PrinterStatus:
+    """Последнее известное состояние принтера по уведомлениям 5a02."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Состояние неизвестно: до первого уведомления 5a02 нового соединения.
+        Без соединения принтер может успеть зарядиться или получить бумагу,
+        поэтому старое состояние не должно отклонять задания.
+        """
+        self.battery = None  # Заряд в процентах или None, если неизвестен
+        self.paper_out = False  # Нет бумаги или открыт лоток
+        self.charging = False  # Подключено зарядное устройство
+        self.updated = None  # Время последнего уведомления о состоянии
+
+    @property
+    def can_print(self):
+        return not self.paper_out
 
 
 class BLEPrinter:
-    def __init__(self, target_name="LX-D02", black_level=9):
+    def __init__(self, target_name="LX-D02", black_level=9, address=None):
         self.target_name = target_name
-        self.address = None
+        self.address = address
+        self.disconnected = asyncio.Event()
+        self.disconnected.set()
         self.char_uuid = "0000ffe1-0000-1000-8000-00805f9b34fb"
         self.notify_uuid = "0000ffe2-0000-1000-8000-00805f9b34fb"
         self.client = None
@@ -16,26 +81,50 @@ class BLEPrinter:
         self.pause_required = asyncio.Event()
         self.is_printed = False  # 5a0600c10100000000000000 принтер готов к печати
         self.latest_notification = ""
+        self.status = PrinterStatus()
         self.black_level = black_level
+        # Пауза после пакета из пустых строк: их печать — это лишь протяжка бумаги,
+        # поэтому ждать полные 40 мс не нужно (переполнение буфера принтер
+        # всё равно сообщает уведомлением 5a0714). Сами пакеты не сжимаются:
+        # команда протяжки и укороченный кадр для LX-D02 не известны, пустые
+        # строки уходят полными пакетами, быстрее становится только их темп
+        self.blank_packet_delay = 0.005
+        # Алгоритм перевода в 1 бит (см. dithering.DITHER_MODES)
+        self.dither_mode = "auto"
+        # Передача: режим записи (BLE_WRITE_MODES) и предел пакетов в одной
+        # записи GATT (1 — по пакету; 0 — сколько поместится в MTU, склейка
+        # пока не проверена на всех принтерах и включается явно)
+        self.write_mode = "auto"
+        self.packets_per_write = 1
+        # Подбор ориентации (ORIENTATION_MODES) и обрезка белых полей перед печатью
+        self.orientation = "none"
+        self.trim = False
+        # Определяются по характеристике после подключения (configure_transmit)
+        self.max_write_size = DEFAULT_WRITE_SIZE
+        self.write_without_response = False
         # Команды для работы с принтером
         self.commands = [
             ("5a0100000000000000000000", "5a010003c00000001b965a00"),  # Инициализация
             (self.set_black_level(self.black_level), "5a0c"),  # Параметр черного
         ]
 
-    async def find_and_connect(self):
+    async def find_and_connect(self, exclude=()):
+        from bleak import BleakScanner
+        from bleak.exc import BleakDBusError
+
         try:
             """
             Ищет устройство Bluetooth по имени и подключается к нему.
 
             :param target_name: Имя целевого устройства.
+            :param exclude: Адреса устройств, которые уже заняты другими принтерами.
             """
             print("Поиск устройств Bluetooth...")
             devices = await BleakScanner.discover()
             target_name = self.target_name
             for device in devices:
                 print(f"Найдено устройство: {device.name} [{device.address}]")
-                if device.name == target_name:
+                if device.name == target_name and device.address not in exclude:
                     self.address = device.address  # Устанавливаем адрес устройства
                     print(f"Устройство '{target_name}' найдено. Подключаемся...")
                     await self.connect(device.address)
@@ -58,8 +147,12 @@ class BLEPrinter:
 
     async def connect(self, address):
         """Подключается к принтеру."""
+        from bleak import BleakClient
+
         self.address = address
-        self.client = BleakClient(self.address)
+        self.client = BleakClient(
+            self.address, disconnected_callback=self.disconnected_handler
+        )
         await self.client.connect()
         cccd_handle = await self.find_cccd_handle(self.char_uuid)
         if not self.client.is_connected:
@@ -67,15 +160,55 @@ class BLEPrinter:
 
         print("Принтер подключен.")
 
+        # Состояние прошлого соединения устарело, ждём свежее 5a02
+        self.status.reset()
         # Подписываемся на уведомления
         await self.client.start_notify(self.notify_uuid, self.notification_handler)
         print("Подписка на уведомления установлена.")
+        self.configure_transmit()
+        self.disconnected.clear()
+
+    def configure_transmit(self):
+        """
+        Настраивает передачу по согласованному MTU: сколько байт помещается
+        в одну запись и можно ли писать без подтверждения (write-without-response).
+        """
+        char = self.client.services.get_characteristic(self.char_uuid)
+        if char is None:
+            self.max_write_size = max(DEFAULT_WRITE_SIZE, self.client.mtu_size - 3)
+            self.write_without_response = False
+        else:
+            self.max_write_size = char.max_write_without_response_size
+            self.write_without_response = (
+                self.write_mode == "auto"
+                and "write-without-response" in char.properties
+            )
+        print(
+            f"Запись до {self.max_write_size} байт, "
+            f"{'без подтверждения' if self.write_without_response else 'с подтверждением'}."
+        )
+
+    @property
+    def is_connected(self):
+        """True, если BLE-соединение с принтером активно."""
+        return self.client is not None and self.client.is_connected
+
+    def disconnected_handler(self, client):
+        """Вызывается bleak при обрыве соединения с принтером."""
+        print(f"Соединение с принтером {client.address} потеряно.")
+        self.status.reset()
+        self.disconnected.set()
 
     async def disconnect(self):
         """Отключается от принтера."""
         if self.client and self.client.is_connected:
-            await self.client.stop_notify(self.notify_uuid)
+            try:
+                await self.client.stop_notify(self.notify_uuid)
+            except Exception:
+                # Подписка могла не успеть установиться (подключение не завершено)
+                pass
             await self.client.disconnect()
+            self.status.reset()
             print("Принтер отключен.")
 
     async def find_cccd_handle(self, char_uuid):
@@ -114,6 +247,7 @@ class BLEPrinter:
             # Проверяем состояние бумаги и лотка
             if len(data_hex) >= 8:  # Убедимся, что длина данных достаточна
                 paper_status_byte = data_hex[6:8]  # Извлекаем четвертый байт (2 символа, начиная с индекса 6)
+                self.status.paper_out = paper_status_byte == "01"
                 if paper_status_byte == "01":
                     print("Нет бумаги или открыт лоток принтера.")
 
@@ -124,7 +258,10 @@ class BLEPrinter:
                     print("Идет заряд батареи...")
                 if charging_status_byte == "02":
                     print("Батарея заряжена!")
+                self.status.charging = charging_status_byte in ("01", "02")
 
+            self.status.battery = battery_percentage
+            self.status.updated = time.time()
             if battery_percentage is not None:
                 print(f"Уровень заряда батареи: {battery_percentage}%")
             else:
@@ -137,7 +274,15 @@ class BLEPrinter:
             print("Принтер готов к печати.")
             self.ready_to_print.set()
 
-    async def send_packets(self, packets_hex):
+    async def send_packets(self, packets_hex, total=None):
+        """
+        Отправляет пакеты на принтер.
+
+        :param packets_hex: Список или генератор строк данных в формате HEX.
+        :param total: Число пакетов; обязательно, если packets_hex — генератор.
+        """
+        if total is None:
+            total = len(packets_hex)
         command_start_print = [
             ("5a0a2e58f6181b79f1075dc3", "5a0a"),
             ("5a0bdefb0c26fe2d159b822c", "5a0b"),
@@ -146,12 +291,17 @@ class BLEPrinter:
             print("Отправка команды/префикс:", command, expected_prefix)
             await self.send_command(command, expected_prefix)
 
-        start_line, end_line = self.generate_hex_string_len(packets_hex)
+        start_line, end_line = self.generate_hex_string_len(total)
         packets = self.validate_and_correct_line_numbers(packets_hex)
-        max_packet = len(packets)
-        for idx, hex_data in enumerate(packets):
+        max_packet = total
+        blank_run = 0
+        for idx, batch in self.coalesce_packets(packets):
             try:
-                # Проверяем, нужно ли сделать паузу
+                # Запись без подтверждения обрыв связи не замечает
+                if self.disconnected.is_set():
+                    raise ConnectionError("Соединение с принтером потеряно.")
+                # Проверяем, нужно ли сделать паузу. Без подтверждения записей
+                # переполнение буфера видно только по уведомлению 5a0714
                 if self.pause_required.is_set():
                     print("Пауза на 59 мс...")
                     await asyncio.sleep(0.59)  # Пауза 59 мс
@@ -164,33 +314,96 @@ class BLEPrinter:
                     await self.client.write_gatt_char(self.char_uuid, end_line)
                     await asyncio.sleep(0.1)
 
-                # Преобразуем данные в байты
-                data = bytearray.fromhex(hex_data)
+                # Преобразуем данные в байты: несколько пакетов подряд в одной записи
+                data = bytearray.fromhex("".join(batch))
 
                 # Отправляем данные на принтер
-                await self.client.write_gatt_char(self.char_uuid, data)
+                await self.write_packets(data)
+
+                # Серии пустых строк отправляем подряд с короткой паузой (пакеты
+                # те же, что и для строк с точками, — меняется только темп)
+                if all(self.is_blank_packet(hex_data) for hex_data in batch):
+                    blank_run += len(batch)
+                    await asyncio.sleep(self.blank_packet_delay)
+                    continue
+                if blank_run:
+                    print(f"Отправлено пустых пакетов подряд: {blank_run}")
+                    blank_run = 0
+
                 print(
-                    f"[{idx}/{len(packets_hex)}] Отправлен {len(data)}-байтный пакет: {hex_data[:40]}..."
+                    f"[{idx}/{total}] Отправлено пакетов: {len(batch)}, "
+                    f"{len(data)} байт: {batch[0][:40]}..."
                 )
 
-                # Основная пауза между отправкой пакетов
+                # Основная пауза между записями
                 await asyncio.sleep(0.04)
 
             except Exception as e:
-                print(f"Ошибка при отправке пакета {idx+1}: {e}")
-                break
+                # Обрыв связи посреди задания: страница не напечатана целиком
+                raise ConnectionError(f"Ошибка при отправке пакета {idx+1}: {e}") from e
+
+        if blank_run:
+            print(f"Отправлено пустых пакетов подряд: {blank_run}")
+
+    def coalesce_packets(self, packets):
+        """
+        Объединяет идущие подряд пакеты в записи GATT не длиннее max_write_size
+        байт (и не больше packets_per_write пакетов, если он задан): каждая
+        запись — это отдельный обмен по радио.
+
+        :return: Генератор (номер первого пакета, список пакетов HEX).
+        """
+        batch = []
+        size = 0
+        first = 0
+        for idx, hex_data in enumerate(packets):
+            packet_size = len(hex_data) // 2
+            if batch and (
+                size + packet_size > self.max_write_size
+                or len(batch) == self.packets_per_write
+            ):
+                yield first, batch
+                batch = []
+                size = 0
+            if not batch:
+                first = idx
+            batch.append(hex_data)
+            size += packet_size
+        if batch:
+            yield first, batch
+
+    async def write_packets(self, data):
+        """
+        Записывает данные в характеристику принтера. Без подтверждения — только
+        если характеристика это поддерживает и данные помещаются в одну запись;
+        иначе режим записи выбирает bleak по свойствам характеристики, как и
+        для команд.
+        """
+        if self.write_without_response and len(data) <= self.max_write_size:
+            response = False
+        elif self.write_mode == "response":
+            response = True
+        else:
+            response = None
+        await self.client.write_gatt_char(self.char_uuid, data, response=response)
+
+    @staticmethod
+    def is_blank_packet(hex_data):
+        """
+        Проверяет, что пакет 55<номер><данные>00 не содержит чёрных точек.
+
+        :param hex_data: Пакет в формате HEX с номером строки.
+        """
+        return hex_data.startswith("55") and not hex_data[6:-2].strip("0")
 
     async def wait_for_print_completion(self):
         """
         Ожидает уведомления о завершении печати.
         """
         print("Ожидание завершения печати...")
-        while True:
-            await asyncio.sleep(0.1)
-            if self.latest_notification.startswith("5a060"):
-                print("Принтер завершил печать.")
-                self.is_printed = False
-                break
+        await self.wait_for_notification("5a060", PRINT_COMPLETION_TIMEOUT)
+        print("Принтер завершил печать.")
+        self.is_printed = False
 
     async def send_command(self, command, expected_response_prefix):
         """Отправляет команду на принтер и ждёт ожидаемого ответа."""
@@ -199,20 +412,34 @@ class BLEPrinter:
             await self.client.write_gatt_char(self.char_uuid, data)
             print(f"Отправлено: {command}")
             await asyncio.sleep(0.1)
-            # Ждём ответа от принтера
-            while True:
-                await asyncio.sleep(0.2)
-                if self.latest_notification.startswith(expected_response_prefix):
-                    print(f"Получен ожидаемый ответ: {self.latest_notification}")
-                    break
+            await self.wait_for_notification(expected_response_prefix, COMMAND_TIMEOUT)
+            print(f"Получен ожидаемый ответ: {self.latest_notification}")
+
+    async def wait_for_notification(self, prefix, timeout):
+        """
+        Ждёт уведомления принтера с префиксом prefix.
+        Обрыв связи — ConnectionError, нет ответа за timeout секунд — TimeoutError.
+        """
+        deadline = time.monotonic() + timeout
+        while not self.latest_notification.startswith(prefix):
+            if self.disconnected.is_set():
+                raise ConnectionError("Соединение с принтером потеряно.")
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Принтер не ответил {prefix} за {timeout:g} с.")
+            await asyncio.sleep(0.1)
 
-    def is_document(self, image):
+    @staticmethod
+    def is_document(image):
         """
         Определяет, является ли изображение документом (текст, линии)
         или фотографией.
+
+        Это единственный классификатор и для CLI, и для сервера: гистограмма
+        строится по уменьшенной копии, для доли тёмных и светлых точек полный
+        размер не нужен.
         """
-        # Преобразуем изображение в оттенки серого
-        grayscale_image = image.convert("L")
+        # Уменьшенная копия в оттенках серого
+        grayscale_image = BLEPrinter._preview(image)
 
         # Получаем гистограмму яркости (0-255)
         histogram = grayscale_image.histogram()
@@ -226,83 +453,215 @@ class BLEPrinter:
             return True  # Это документ
         return False  # Это фотография
 
-    def generate_printer_data(self, image_path, target_width=384):
+    def generate_printer_data(
+        self, image_path, target_width=384, dither_mode=None, document=None
+    ):
         """
         Генерирует строки данных для печати с учётом полутонов через дизеринг.
         :param image_path: Путь к изображению.
         :param target_width: Ширина изображения для принтера (обычно 384 пикселя).
+        :param dither_mode: Режим дизеринга (см. dithering.DITHER_MODES).
+        :param document: Готовый результат is_document() или None.
         :return: Список строк данных в формате HEX.
         """
-        with Image.open(image_path) as img:
+        _total, packets = self.iter_printer_data(
+            image_path, target_width, dither_mode=dither_mode, document=document
+        )
+        return list(packets)
+
+    def iter_printer_data(
+        self,
+        image_path,
+        target_width=384,
+        band_height=256,
+        dither_mode=None,
+        document=None,
+        orientation=None,
+    ):
+        """
+        Потоковый вариант generate_printer_data: кодирует изображение
+        горизонтальными полосами и отдаёт пакеты по мере готовности.
 
-            # Преобразуем изображение в оттенки серого
-            img = img.convert("L")
+        Число пакетов известно заранее из размеров изображения, поэтому
+        заголовок 5a04 можно отправить до кодирования всей картинки.
+        :param image_path: Путь к изображению, файловый объект или готовое Image.
+        :param target_width: Ширина изображения для принтера (обычно 384 пикселя).
+        :param band_height: Высота полосы в строках принтера (чётная).
+        :param dither_mode: Режим дизеринга; по умолчанию self.dither_mode.
+        :param document: Результат классификации, если он уже известен
+                         (например, сервер классифицировал страницу при обрезке);
+                         None — классифицировать здесь.
+        :param orientation: Режим ориентации; по умолчанию self.orientation.
+        :return: Кортеж (число пакетов, генератор строк данных в формате HEX).
+        """
+        from PIL import Image
+
+        if isinstance(image_path, Image.Image):
+            img = image_path
+        else:
+            img = Image.open(image_path)  # Читает только заголовок файла
+            if img.format == "JPEG" and img.width > target_width:
+                # JPEG декодируется сразу в уменьшенном масштабе (1/2, 1/4, 1/8),
+                # но не меньше ширины принтера — полный размер не нужен
+                requested = (target_width, int(target_width / img.width * img.height))
+                img.draft("L", requested)
+        fitted = self.fit_orientation(img, target_width, orientation)
+        if fitted is not img and not isinstance(image_path, Image.Image):
+            img.close()
+        img = fitted
+        if img.width != target_width:
+            height = int((target_width / img.width) * img.height)
+        else:
+            height = img.height
+        # Высота должна быть чётной: в пакете две строки
+        height -= height % 2
+        band_height = max(2, band_height - band_height % 2)
+        dither_mode = dither_mode or self.dither_mode
+        return height // 2, self._encode_bands(
+            img, target_width, height, band_height, dither_mode, document
+        )
+
+    def fit_orientation(self, img, target_width=384, orientation=None):
+        """
+        Готовит изображение к печати: обрезает белые поля (если включено
+        self.trim) и в режиме auto поворачивает на 90°, если после
+        масштабирования к ширине головки выйдет меньше строк — время печати
+        и передачи пропорционально числу строк. Готовые 1-битные изображения
+        ширины головки (этикетки, штрих-коды, текст) не трогаются: они уже
+        собраны под 384 точки с целой шириной модуля.
+
+        :return: То же изображение или новое (обрезанное и/или повёрнутое).
+        """
+        from PIL import Image
+
+        orientation = orientation or self.orientation
+        if img.mode == "1" and img.width == target_width:
+            return img
+        if self.trim:
+            # Поля ищутся по уменьшенной копии: полноразмерная не нужна
+            preview = self._preview(img)
+            box = preview.point(lambda v: 255 if v < TRIM_WHITE_LEVEL else 0).getbbox()
+            if box and box != (0, 0, preview.width, preview.height):
+                sx = img.width / preview.width
+                sy = img.height / preview.height
+                img = img.crop(
+                    (
+                        int(box[0] * sx),
+                        int(box[1] * sy),
+                        min(img.width, int(box[2] * sx + sx)),
+                        min(img.height, int(box[3] * sy + sy)),
+                    )
+                )
+        if orientation != "auto":
+            return img
+        lines = target_width * img.height / img.width
+        rotated_lines = target_width * img.width / img.height
+        # Масштаб в повёрнутой ориентации относительно исходной
+        rotated_scale = img.width / img.height
+        if rotated_lines < lines and rotated_scale >= MIN_ROTATED_SCALE:
+            print(f"Поворот на 90°: {int(rotated_lines)} строк вместо {int(lines)}.")
+            # Против часовой стрелки, как LandscapeOrientation: Plus90 в PPD
+            return img.transpose(Image.ROTATE_90)
+        return img
+
+    def _encode_bands(
+        self, img, target_width, height, band_height, dither_mode, document
+    ):
+        from PIL import Image
+
+        with img:
+            scale = img.height / height if height else 1
+            # Запас строк источника вокруг полосы, чтобы фильтр LANCZOS не давал швов
+            margin = int(3 * max(scale, 1)) + 2
+            # Строки перед полосой, которые дизерингуются повторно, чтобы ошибка
+            # диффузионного дизеринга «перетекала» через границу полос
+            overlap = 16
+
+            # Готовое 1-битное изображение нужной ширины (например, этикетка
+            # из label_renderer) печатаем как есть, без масштабирования и дизеринга
+            exact = img.mode == "1" and img.width == target_width
+
+            if exact:
+                document = True
+            elif document is None and dither_mode == "auto":
+                # Классификация нужна только автоматическому режиму дизеринга
+                document = self.is_document(img)
+            debug_img = img if exact else Image.new("1", (target_width, height), 1)
+
+            row_bytes = (target_width + 7) // 8
+            # Маска для неиспользуемых бит последнего байта строки
+            tail_mask = (0xFF << (row_bytes * 8 - target_width)) & 0xFF
+
+            for top in range(0, height, band_height):
+                bottom = min(top + band_height, height)
+                if exact:
+                    band = img.crop((0, top, target_width, bottom))
+                    data = band.tobytes().translate(INVERT_BITS)
+                    yield from self._pack_rows(data, band.height, row_bytes, tail_mask)
+                    continue
+                ext_top = max(0, top - overlap)
+
+                # Участок источника для полосы [ext_top, bottom) с запасом
+                src_top = ext_top * scale
+                src_bottom = bottom * scale
+                crop_top = max(0, int(src_top) - margin)
+                crop_bottom = min(img.height, int(src_bottom) + 1 + margin)
+                source = img.crop((0, crop_top, img.width, crop_bottom)).convert("L")
+                band = source.resize(
+                    (target_width, bottom - ext_top),
+                    Image.LANCZOS,
+                    box=(0, src_top - crop_top, img.width, src_bottom - crop_top),
+                    # Большие изображения сначала уменьшаются целочисленно (reduce),
+                    # и лишь затем сглаживаются LANCZOS
+                    reducing_gap=3.0,
+                )
+                band = dither(band, dither_mode, document, top=ext_top)
+                band = band.crop((0, top - ext_top, target_width, band.height))
+                debug_img.paste(band, (0, top))
 
-            # Масштабируем изображение до ширины принтера
-            if img.width != target_width:
-                new_height = int((target_width / img.width) * img.height)
-                img = img.resize((target_width, new_height), Image.LANCZOS)
+                # В режиме "1" бит 1 — белый, а принтеру нужен 1 для чёрной точки
+                data = band.tobytes().translate(INVERT_BITS)
+                yield from self._pack_rows(data, band.height, row_bytes, tail_mask)
 
-            if self.is_document(img):
-                img = img.convert("1", dither=Image.NONE)
-                img.save(".debug_images/debug_document_image.png")
+            if document:
+                debug_img.save(".debug_images/debug_document_image.png")
                 print("Промежуточный документ сохранен как debug_document_image.png")
             else:
-                # Применяем дизеринг
-                img = img.convert("1", dither=Image.FLOYDSTEINBERG)
-
                 # Сохраняем для отладки
-                img.save(".debug_images/debug_dithered_image.png")
+                debug_img.save(".debug_images/debug_dithered_image.png")
                 print(
                     "Промежуточное изображение с дизерингом сохранено как debug_dithered_image.png"
                 )
 
-            # Убедимся, что высота чётная
-            if img.height % 2 != 0:
-                img = img.crop((0, 0, img.width, img.height - 1))
-
-            printer_width = img.width
-            packets = []
-
-            # Формируем данные для принтера
-            for y in range(0, img.height, 2):
-                upper_line = []
-                lower_line = []
-
-                for x in range(0, printer_width, 8):
-                    upper_byte = 0
-                    lower_byte = 0
-
-                    for bit in range(8):
-                        if x + bit < printer_width:
-                            # Верхняя строка
-                            if img.getpixel((x + bit, y)) == 0:  # Чёрный пиксель
-                                upper_byte |= 1 << (7 - bit)
-                            # Нижняя строка
-                            if (
-                                y + 1 < img.height and img.getpixel((x + bit, y + 1)) == 0
-                            ):  # Чёрный пиксель
-                                lower_byte |= 1 << (7 - bit)
-
-                    upper_line.append(upper_byte)
-                    lower_line.append(lower_byte)
-
-                # Формируем HEX-строки
-                upper_hex = "".join(f"{byte:02x}" for byte in upper_line)
-                lower_hex = "".join(f"{byte:02x}" for byte in lower_line)
-
-                packets.append(f"{upper_hex}{lower_hex}")
-
-        return packets
+    @staticmethod
+    def _pack_rows(data, rows, row_bytes, tail_mask):
+        """Собирает пакеты из пар строк упакованных бит (1 — чёрная точка)."""
+        for y in range(0, rows, 2):
+            upper = bytearray(data[y * row_bytes : (y + 1) * row_bytes])
+            lower = bytearray(data[(y + 1) * row_bytes : (y + 2) * row_bytes])
+            upper[-1] &= tail_mask
+            lower[-1] &= tail_mask
+            yield f"{upper.hex()}{lower.hex()}"
+
+    @staticmethod
+    def _preview(img, max_pixels=CLASSIFY_PIXELS):
+        """Уменьшенная копия изображения для классификации документ/фото."""
+        factor = max(1, int((img.width * img.height / max_pixels) ** 0.5))
+        # Уменьшаем до перевода в "L", чтобы не создавать полноразмерную копию
+        if factor > 1 and img.mode in ("L", "LA", "RGB", "RGBA"):
+            return img.reduce(factor).convert("L")
+        preview = img.convert("L")
+        if factor > 1:
+            preview = preview.reduce(factor)
+        return preview
 
     def validate_and_correct_line_numbers(self, packet_list):
         """
         Проверяет и корректирует нумерацию строк в массиве.
 
-        :param packet_list: Список строк, содержащих пакеты данных (в формате HEX).
-        :return: Исправленный список пакетов.
+        :param packet_list: Строки (список или генератор), содержащие пакеты данных (в формате HEX).
+        :return: Генератор исправленных пакетов.
         """
-        corrected_packets = []
         for idx, packet in enumerate(packet_list):
             if packet.startswith("55") and packet.endswith("00"):
                 # Извлекаем текущий номер строки
@@ -320,15 +679,11 @@ class BLEPrinter:
                 expected_number = f"{idx:04x}"
                 corrected_packet = f"55{expected_number}{packet}00"
 
-            corrected_packets.append(corrected_packet)
-
-        return corrected_packets
-
-        return True, "Нумерация строк корректна"
+            yield corrected_packet
 
-    def generate_hex_string_len(self, data_list):
-        # Вычисляем количество записей в списке
-        total_records = len(data_list) + 1
+    def generate_hex_string_len(self, packet_count):
+        # Количество записей: пакеты данных плюс завершающая
+        total_records = packet_count + 1
 
         # Преобразуем количество записей в 4-значное шестнадцатеричное число
         final_number = f"{total_records:04x}"
@@ -343,13 +698,13 @@ class BLEPrinter:
         return bytearray.fromhex(start_message), bytearray.fromhex(end_message)
 
     async def print_image(self, image_path):
-        """Печатает изображение."""
-        packets = self.generate_printer_data(image_path)
-        self.is_printed = True
-        print("Начинаем печать изображения.")
-        await self.send_packets(packets)
-        await self.wait_for_print_completion()
-        print("Печать завершена.")
+        """
+        Печатает изображение, начиная передачу до окончания кодирования.
+        :return: Число отправленных пакетов (по две строки точек в каждом).
+        """
+        total, packets = self.iter_printer_data(image_path)
+        await self.print_packets(packets, total)
+        return total
 
     async def initialize(self):
         """Отправляет начальные команды принтеру."""
@@ -358,46 +713,482 @@ class BLEPrinter:
             print("Отправка команды/префикс:", command, expected_prefix)
             await self.send_command(command, expected_prefix)
 
-    async def ble_print_job(self, image_bytes):
-        """Асинхронно подключается к принтеру и печатает"""
-        if not self.client or not self.client.is_connected:
+    async def connect_and_initialize(self, exclude=()):
+        """Подключается к принтеру (по адресу или поиском по имени) и инициализирует его."""
+        if self.address is not None:
+            await self.connect(self.address)
+        else:
+            await self.find_and_connect(exclude)
+        await self.initialize()
+
+    async def print_packets(self, packets, total=None):
+        """Печатает заранее закодированные пакеты (список или генератор с total)."""
+        self.is_printed = True
+        try:
+            print("Начинаем печать изображения.")
+            await self.send_packets(packets, total)
+            await self.wait_for_print_completion()
+        finally:
+            # И после ошибки передачи: иначе соединение не закроется по простою
+            self.is_printed = False
+        print("Печать завершена.")
+
+    async def ble_print_packets(self, packets, connection_manager=None, total=None):
+        """Асинхронно подключается к принтеру и печатает готовые пакеты"""
+        if connection_manager is not None:
+            await connection_manager.ensure_connected()
+        elif not self.is_connected:
             print("Принтер не подключен. Подключаемся...")
-            await self.find_and_connect()  # Асинхронный коннект
-            await self.initialize()  # Отправляем начальные команды
-        await self.print_image(image_bytes)
+            await self.connect_and_initialize()
+        try:
+            await self.print_packets(packets, total)
+        finally:
+            if connection_manager is not None:
+                connection_manager.touch()
         # await ble_printer.disconnect()
 
 
+class BLEConnectionManager:
+    """
+    Держит BLE-соединение с принтером «тёплым».
+
+    Подключается и инициализирует принтер при старте, следит за обрывами связи
+    и переподключается в фоне с экспоненциальной задержкой. Если задан
+    idle_timeout, разрывает соединение после простоя, чтобы экономить батарею
+    принтера; следующее задание подключится заново через ensure_connected().
+    """
+
+    def __init__(
+        self,
+        printer,
+        idle_timeout=None,
+        reconnect_delay=1.0,
+        max_reconnect_delay=60.0,
+        check_interval=5.0,
+        exclude=None,
+    ):
+        self.printer = printer
+        # Функция, возвращающая адреса, которые нельзя занимать при поиске по имени
+        self.exclude = exclude
+        self.idle_timeout = idle_timeout
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.check_interval = check_interval
+        self.last_activity = time.monotonic()
+        self.idle = False  # Соединение разорвано намеренно из-за простоя
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        """Запускает фоновую задачу менеджера. Вызывать из цикла событий BLE."""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    async def stop(self):
+        """Останавливает фоновую задачу и отключается от принтера."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.printer.disconnect()
+
+    def touch(self):
+        """Отмечает активность (задание печати), откладывая отключение по простою."""
+        self.last_activity = time.monotonic()
+
+    async def _connect(self):
+        async with self._lock:
+            if self.printer.is_connected:
+                return
+            print("Подключение к принтеру...")
+            exclude = self.exclude() if self.exclude is not None else ()
+            try:
+                await self.printer.connect_and_initialize(exclude)
+            except Exception:
+                # Соединение установлено, но принтер не настроен: разрываем его,
+                # иначе run() считает принтер подключённым и не повторяет попытку
+                try:
+                    await self.printer.disconnect()
+                except Exception as e:
+                    print(f"Ошибка при отключении от принтера: {e}")
+                self.printer.client = None
+                self.printer.disconnected.set()
+                raise
+            self.idle = False
+            self.touch()
+
+    async def ensure_connected(self):
+        """Гарантирует готовое соединение перед заданием печати."""
+        self.touch()
+        self._wakeup.set()
+        if not self.printer.is_connected:
+            await self._connect()
+
+    def _idle_expired(self):
+        return (
+            self.idle_timeout is not None
+            and not self.printer.is_printed
+            and not self._lock.locked()
+            and time.monotonic() - self.last_activity >= self.idle_timeout
+        )
+
+    async def run(self):
+        delay = self.reconnect_delay
+        while True:
+            # После отключения по простою ждём следующего задания
+            if self.idle:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            if not self.printer.is_connected:
+                try:
+                    await self._connect()
+                    delay = self.reconnect_delay
+                except Exception as e:
+                    print(
+                        f"Не удалось подключиться к принтеру: {e}. Повтор через {delay:g} с."
+                    )
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.max_reconnect_delay)
+                    continue
+
+            # Ждём обрыва связи, периодически проверяя простой
+            try:
+                await asyncio.wait_for(
+                    self.printer.disconnected.wait(), timeout=self.check_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+
+            if self._idle_expired() and self.printer.is_connected:
+                print("Принтер простаивает, отключаемся для экономии батареи.")
+                self.idle = True
+                await self.printer.disconnect()
+
+
+class PrinterPool:
+    """
+    Пул BLE-принтеров с отдельным соединением для каждого устройства.
+
+    Принтеры задаются именем Bluetooth-устройства или MAC-адресом; одно и то же
+    имя можно указать несколько раз, тогда каждому экземпляру достанется своё
+    устройство. Задания получают свободный принтер через acquire() и
+    возвращают его через release().
+    """
+
+    def __init__(
+        self,
+        specs=("LX-D02",),
+        black_level=9,
+        idle_timeout=None,
+        write_mode="auto",
+        packets_per_write=1,
+        shortest_first=False,
+        aging_interval=30,
+    ):
+        self.printers = []
+        self.managers = {}
+        # Очередь ожидающих принтер: при shortest_first среди заданий равного
+        # приоритета раньше получает короткое, ожидание поднимает приоритет
+        self.shortest_first = shortest_first
+        self.aging_interval = aging_interval
+        self._waiters = []
+        self._sequence = 0
+        for spec in specs:
+            if MAC_ADDRESS_RE.match(spec):
+                printer = BLEPrinter(black_level=black_level, address=spec)
+            else:
+                printer = BLEPrinter(target_name=spec, black_level=black_level)
+            printer.write_mode = write_mode
+            printer.packets_per_write = packets_per_write
+            self.printers.append(printer)
+            self.managers[printer] = BLEConnectionManager(
+                printer, idle_timeout=idle_timeout, exclude=self.claimed_addresses
+            )
+        self._busy = set()
+        self._condition = asyncio.Condition()
+
+    def claimed_addresses(self):
+        """Адреса устройств, уже закреплённых за принтерами пула."""
+        return {p.address for p in self.printers if p.address is not None}
+
+    def connection_manager(self, printer):
+        return self.managers[printer]
+
+    def is_busy(self, printer):
+        return printer in self._busy
+
+    def can_accept(self, target=None):
+        """
+        Можно ли принять задание: у выбранного принтера (или хотя бы у одного
+        принтера пула) есть бумага.
+        """
+        printers = self.printers if target is None else [target]
+        return any(p.status.can_print for p in printers)
+
+    async def discover(self):
+        """
+        Одним сканированием назначает адреса принтерам, заданным по имени,
+        чтобы менеджеры соединений подключались сразу по адресу.
+        """
+        unassigned = [p for p in self.printers if p.address is None]
+        if not unassigned:
+            return
+        from bleak import BleakScanner
+        from bleak.exc import BleakDBusError
+
+        print("Поиск принтеров пула...")
+        try:
+            devices = await BleakScanner.discover()
+        except BleakDBusError as e:
+            print(f"Bluetooth выключен или не доступен. {e}")
+            return
+        except Exception as e:
+            # Менеджеры соединений всё равно будут искать принтеры по имени
+            print(f"Не удалось выполнить поиск принтеров: {e}")
+            return
+        claimed = self.claimed_addresses()
+        for printer in unassigned:
+            for device in devices:
+                if device.name == printer.target_name and device.address not in claimed:
+                    printer.address = device.address
+                    claimed.add(device.address)
+                    print(f"Принтер '{printer.target_name}' -> [{device.address}]")
+                    break
+            else:
+                print(f"Принтер '{printer.target_name}' пока не найден.")
+
+    async def start(self):
+        await self.discover()
+        for manager in self.managers.values():
+            manager.start()
+
+    async def stop(self):
+        for manager in self.managers.values():
+            await manager.stop()
+
+    def _idle_printers(self, target=None):
+        candidates = [
+            p
+            for p in self.printers
+            if p not in self._busy and (target is None or p is target)
+        ]
+        # Сначала уже подключённые принтеры, чтобы не ждать соединения
+        candidates.sort(key=lambda p: not p.is_connected)
+        return candidates
+
+    def _rank(self, waiter, now):
+        """
+        Место в очереди: выше приоритет (каждые aging_interval секунд ожидания
+        добавляют AGING_STEP), затем меньше пакетов (при shortest_first),
+        затем раньше пришло.
+        """
+        priority = waiter["priority"]
+        if self.aging_interval:
+            waited = now - waiter["since"]
+            priority += int(waited / self.aging_interval) * AGING_STEP
+        size = (waiter["packets"] or 0) if self.shortest_first else 0
+        return -priority, size, waiter["sequence"]
+
+    def _next_waiter(self, printer):
+        """Ожидающий, которому достаётся освободившийся принтер."""
+        now = time.monotonic()
+        waiters = [
+            w for w in self._waiters if w["target"] is None or w["target"] is printer
+        ]
+        return min(waiters, key=lambda w: self._rank(w, now), default=None)
+
+    async def acquire(self, target=None, priority=DEFAULT_JOB_PRIORITY, packets=None):
+        """
+        Ждёт свободный принтер и помечает его занятым. Если принтер ждут
+        несколько заданий, он достаётся первому по _rank().
+
+        :param target: Конкретный принтер пула или None для любого свободного.
+        :param priority: Приоритет задания (job-priority, 1–100).
+        :param packets: Размер задания в пакетах строк для shortest_first.
+        """
+        waiter = {
+            "target": target,
+            "priority": priority,
+            "packets": packets,
+            "since": time.monotonic(),
+            "sequence": self._sequence,
+        }
+        self._sequence += 1
+        async with self._condition:
+            self._waiters.append(waiter)
+            try:
+                while True:
+                    for printer in self._idle_printers(target):
+                        if self._next_waiter(printer) is waiter:
+                            self._busy.add(printer)
+                            return printer
+                    await self._condition.wait()
+            finally:
+                self._waiters.remove(waiter)
+                # Следующий в очереди может претендовать на другой свободный принтер
+                self._condition.notify_all()
+
+    async def release(self, printer):
+        async with self._condition:
+            self._busy.discard(printer)
+            self._condition.notify_all()
+
+
+def expand_inputs(values, patterns=True):
+    """
+    Раскрывает значения аргумента командной строки в список заданий.
+    «-» читает значения из stdin по одному на строку; при patterns=True
+    шаблоны вида labels/*.png раскрываются в отсортированный список файлов.
+    """
+    inputs = []
+    for value in values:
+        if value == "-":
+            inputs.extend(line.strip() for line in sys.stdin if line.strip())
+        elif patterns and glob.has_magic(value):
+            matches = sorted(glob.glob(value))
+            if not matches:
+                print(f"Нет файлов по шаблону {value}")
+            inputs.extend(matches)
+        else:
+            inputs.append(value)
+    return inputs
+
+
+def batch_jobs(args):
+    """Список пар (описание, функция, возвращающая изображение для печати)."""
+    if args.barcode is not None:
+        from label_renderer import render_label
+
+        return [
+            (data, lambda data=data: render_label(args.barcode_type, data))
+            for data in expand_inputs(args.barcode, patterns=False)
+        ]
+    if args.text is not None:
+        from text_renderer import render_text
+
+        def load_text(path):
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                return render_text(f.read())
+
+        return [
+            (path, lambda path=path: load_text(path))
+            for path in expand_inputs(args.text)
+        ]
+    return [(path, lambda path=path: path) for path in expand_inputs(args.file)]
+
+
 async def main():
     parser = argparse.ArgumentParser(description="BLE Printer Script")
-    parser.add_argument(
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
         "--file",
         "-f",
         type=str,
-        required=True,
-        help="Путь к файлу изображения для печати",
+        nargs="+",
+        help="Файлы изображений для печати: пути, шаблоны (*.png) или «-» — список из stdin",
+    )
+    source.add_argument(
+        "--barcode",
+        type=str,
+        nargs="+",
+        help="Данные штрих-кодов/QR-кодов для печати без растеризации («-» — из stdin)",
+    )
+    source.add_argument(
+        "--text",
+        type=str,
+        nargs="+",
+        help="Текстовые файлы для печати без растеризации PDF (шаблоны, «-» — из stdin)",
+    )
+    parser.add_argument(
+        "--barcode-type",
+        choices=("code128", "ean13", "qr"),
+        default="code128",
+        help="Тип кода для --barcode",
     )
     parser.add_argument("--address", "-a", type=str, help="MAC-адрес принтера")
     parser.add_argument(
         "--black_level", "-b", type=int, default=7, help="Уровень черного (0-7)"
     )
+    parser.add_argument(
+        "--dither",
+        choices=DITHER_MODES,
+        default="auto",
+        help="Режим дизеринга: auto — порог для документов, Флойд–Стейнберг для фото",
+    )
     parser.add_argument(
         "--name", "-n", type=str, default="LX-D02", help="Имя Bluetooth устройства"
     )
+    parser.add_argument(
+        "--ble-write",
+        choices=BLE_WRITE_MODES,
+        default="auto",
+        help="Запись в принтер: auto — без подтверждения, если принтер это поддерживает",
+    )
+    parser.add_argument(
+        "--packets-per-write",
+        type=int,
+        default=1,
+        help="Пакетов строк в одной записи BLE (1 — по одному, 0 — сколько поместится в MTU)",
+    )
+    parser.add_argument(
+        "--orientation",
+        choices=ORIENTATION_MODES,
+        default="none",
+        help="auto — повернуть на 90°, если так выходит меньше строк печати",
+    )
+    parser.add_argument(
+        "--trim", action="store_true", help="Обрезать белые поля изображения"
+    )
 
     args = parser.parse_args()
 
-    printer = BLEPrinter(black_level=args.black_level)
-    if args.address is not None:
-        await printer.connect(args.address)
-    else:
-        await printer.find_and_connect()
+    jobs = batch_jobs(args)
+    if not jobs:
+        print("Нечего печатать.")
+        return
+
+    # Все задания печатаются за одно подключение к принтеру
+    printer = BLEPrinter(
+        target_name=args.name, black_level=args.black_level, address=args.address
+    )
+    printer.dither_mode = args.dither
+    printer.write_mode = args.ble_write
+    printer.packets_per_write = args.packets_per_write
+    printer.orientation = args.orientation
+    printer.trim = args.trim
+    await printer.connect_and_initialize()
+    started = time.monotonic()
+    printed = 0
+    packets = 0
     try:
-        await printer.initialize()
-        await printer.print_image(args.file)
+        for index, (name, load) in enumerate(jobs, start=1):
+            print(f"[{index}/{len(jobs)}] {name}")
+            try:
+                packets += await printer.print_image(load())
+                printed += 1
+            except (ConnectionError, TimeoutError):
+                # Связь с принтером потеряна: остальные файлы не напечатать
+                raise
+            except (OSError, ValueError) as e:
+                # Битый файл или неверные данные кода не прерывают пакет
+                print(f"Ошибка печати {name}: {e}")
     finally:
         await printer.disconnect()
 
+    elapsed = time.monotonic() - started
+    print(
+        f"Напечатано {printed} из {len(jobs)} за {elapsed:.1f} с: "
+        f"{printed / elapsed * 60 if elapsed else 0:.1f} шт/мин, "
+        f"{packets * 2 / elapsed if elapsed else 0:.0f} строк/с"
+    )
+
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,129 @@
+"""
+Быстрая печать обычного текста (text/plain) без Ghostscript.
+
+Каждый символ растеризуется шрифтом один раз и хранится в кэше как 1-битная
+маска; строки собираются вставкой готовых глифов в изображение шириной
+печатающей головки.
+"""
+
+from PIL import Image, ImageDraw, ImageFont
+
+PRINTER_WIDTH = 384
+DEFAULT_FONT = "DejaVuSansMono.ttf"
+
+
+class GlyphCache:
+    """Кэш 1-битных глифов одного шрифта."""
+
+    def __init__(self, font_path=None, font_size=20, monospace=True):
+        self.font = self.load_font(font_path, font_size)
+        ascent, descent = self.font.getmetrics()
+        self.line_height = ascent + descent
+        # Ширина ячейки для моноширинной раскладки
+        self.cell_width = int(round(self.font.getlength("0"))) if monospace else None
+        self._glyphs = {}
+
+    @staticmethod
+    def load_font(font_path, font_size):
+        if font_path is not None:
+            return ImageFont.truetype(font_path, font_size)
+        try:
+            return ImageFont.truetype(DEFAULT_FONT, font_size)
+        except OSError:
+            # DejaVu не установлен — встроенный шрифт Pillow
+            return ImageFont.load_default(size=font_size)
+
+    def glyph(self, char):
+        """
+        Возвращает (маска, ширина шага) для символа.
+        Маска — изображение "1" высотой в строку, где 1 — чернила.
+        """
+        cached = self._glyphs.get(char)
+        if cached is not None:
+            return cached
+
+        advance = self.font.getlength(char)
+        if self.cell_width is not None:
+            advance = self.cell_width
+        advance = int(round(advance))
+        left, _top, right, _bottom = self.font.getbbox(char)
+        mask = Image.new("1", (max(advance, right, 1), self.line_height), 0)
+        ImageDraw.Draw(mask).text((0, 0), char, font=self.font, fill=1)
+        if mask.getbbox() is None:
+            mask = None  # Пробелы и непечатаемые символы
+        cached = (mask, advance)
+        self._glyphs[char] = cached
+        return cached
+
+    def text_width(self, text):
+        return sum(self.glyph(char)[1] for char in text)
+
+
+_glyph_caches = {}
+
+
+def get_glyph_cache(font_path=None, font_size=20, monospace=True):
+    """Общий кэш глифов для шрифта: повторные задания не растеризуют символы заново."""
+    key = (font_path, font_size, monospace)
+    cache = _glyph_caches.get(key)
+    if cache is None:
+        cache = _glyph_caches[key] = GlyphCache(font_path, font_size, monospace)
+    return cache
+
+
+def wrap_text(text, cache, width, tab_size=4):
+    """Разбивает текст на строки, помещающиеся в ширину width (по словам)."""
+    lines = []
+    for paragraph in text.expandtabs(tab_size).splitlines():
+        line = ""
+        for word in paragraph.split(" "):
+            candidate = f"{line} {word}" if line else word
+            if cache.text_width(candidate) <= width:
+                line = candidate
+                continue
+            if line:
+                lines.append(line)
+            # Слово длиннее строки разбиваем по символам
+            line = ""
+            for char in word:
+                if line and cache.text_width(line + char) > width:
+                    lines.append(line)
+                    line = ""
+                line += char
+        lines.append(line)
+    return lines
+
+
+def render_text(
+    text,
+    width=PRINTER_WIDTH,
+    font_path=None,
+    font_size=20,
+    monospace=True,
+    margin=4,
+):
+    """
+    Раскладывает текст и рисует его в 1-битное изображение.
+
+    :param text: Текст для печати.
+    :param width: Ширина изображения (обычно 384 точки).
+    :param monospace: Моноширинная раскладка (как в кассовых чеках).
+    :return: Изображение в режиме "1" шириной width.
+    """
+    cache = get_glyph_cache(font_path, font_size, monospace)
+    lines = wrap_text(text, cache, width - 2 * margin)
+    img = Image.new("1", (width, max(1, len(lines)) * cache.line_height), 1)
+    for row, line in enumerate(lines):
+        x = margin
+        y = row * cache.line_height
+        for char in line:
+            mask, advance = cache.glyph(char)
+            if mask is not None:
+                img.paste(0, (x, y, x + mask.width, y + mask.height), mask)
+            x += advance
+    return img
+
+
+def render_text_document(raw_data, charset="utf-8", **options):
+    """Декодирует документ text/plain и рисует его (см. render_text)."""
+    return render_text(raw_data.decode(charset, errors="replace"), **options)